@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# A local stand-in for the parts of the Freshdesk API the tap calls, serving
+# deterministic synthetic data. Run on its own with:
+#   python benchmarks/mock_server.py --port 8000 --tickets 10000
+# and point the tap at it with "base_url": "http://127.0.0.1:8000/".
+import argparse
+import collections
+import csv
+import datetime
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DATETIME_FMT = "%Y-%m-%dT%H:%M:%SZ"
+PAGE_LIMIT = 300
+MAX_PER_PAGE = 100
+EPOCH = datetime.datetime(2023, 1, 1)
+
+SOURCES = [1, 2, 3, 7, 9]
+STATUSES = [2, 3, 4, 5]
+PRIORITIES = [1, 2, 3, 4]
+
+
+def timestamp(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).strftime(DATETIME_FMT)
+
+
+class Dataset:
+    """Synthetic account data, generated once from a seed.
+
+    Tickets are spread over ``span_days`` with several sharing the same second,
+    as they do when many are updated by one automation. Every 50th ticket is
+    deleted and every 97th spam; those are only listed with the matching filter.
+    """
+
+    def __init__(self, tickets=1000, conversations_per_ticket=3, contacts=None, ratings=None,
+                 report_tickets=None, others=50, span_days=30, seed=1):
+        rng = random.Random(seed)
+        span = span_days * 86400
+        self.tickets = []
+        for ticket_id in range(1, tickets + 1):
+            updated = span * ticket_id // max(tickets, 1)
+            self.tickets.append({
+                "id": ticket_id,
+                "subject": "Ticket {}".format(ticket_id),
+                "description_text": "lorem ipsum " * rng.randint(5, 50),
+                "status": rng.choice(STATUSES),
+                "priority": rng.choice(PRIORITIES),
+                "source": rng.choice(SOURCES),
+                "requester_id": rng.randint(1, 10 ** 9),
+                "responder_id": rng.choice([None, rng.randint(1, 10 ** 9)]),
+                "company_id": rng.choice([None, rng.randint(1, 10 ** 6)]),
+                "group_id": None,
+                "type": rng.choice([None, "Question", "Incident"]),
+                "spam": ticket_id % 97 == 0,
+                "deleted": ticket_id % 50 == 0,
+                "is_escalated": rng.choice([True, False]),
+                "cc_emails": [], "fwd_emails": [], "reply_cc_emails": [],
+                "tags": rng.sample(["billing", "vip", "outage", "refund"], rng.randint(0, 3)),
+                "created_at": timestamp(max(updated - rng.randint(0, 86400), 0)),
+                "updated_at": timestamp(updated),
+                "due_by": timestamp(updated + 86400),
+                "fr_due_by": timestamp(updated + 3600),
+                "custom_fields": {"cf_category": rng.choice([None, "Fibre", "Copper"]),
+                                  "cf_account_number": rng.choice([None, rng.randint(1, 10 ** 6)])},
+            })
+        self.ticket_by_id = {ticket["id"]: ticket for ticket in self.tickets}
+        self.conversations_per_ticket = conversations_per_ticket
+
+        contacts = tickets // 2 if contacts is None else contacts
+        self.contacts = [{
+            "id": contact_id,
+            "name": "Contact {}".format(contact_id),
+            "email": "contact{}@example.com".format(contact_id),
+            "active": True,
+            "created_at": timestamp(span * contact_id // max(contacts, 1)),
+            "updated_at": timestamp(span * contact_id // max(contacts, 1)),
+            "custom_fields": {"cf_tier": rng.choice(["gold", "silver", None])},
+        } for contact_id in range(1, contacts + 1)]
+
+        ratings = tickets // 4 if ratings is None else ratings
+        self.ratings = [{
+            "id": rating_id,
+            "survey_id": 1,
+            "ticket_id": rng.randint(1, max(tickets, 1)),
+            "user_id": rng.randint(1, 10 ** 9),
+            "ratings": {"default_question": rng.choice([103, 102, 101, 100, -101, -102, -103])},
+            "feedback": rng.choice(["", "thanks"]),
+            "created_at": timestamp(span * rating_id // max(ratings, 1)),
+            "updated_at": timestamp(span * rating_id // max(ratings, 1)),
+        } for rating_id in range(1, ratings + 1)]
+
+        self.time_entries = [{
+            "id": entry_id,
+            "ticket_id": rng.randint(1, max(tickets, 1)),
+            "billable": True,
+            "time_spent": "01:00",
+            "executed_at": timestamp(span * entry_id // max(tickets // 2, 1)),
+            "created_at": timestamp(span * entry_id // max(tickets // 2, 1)),
+            "updated_at": timestamp(span * entry_id // max(tickets // 2, 1)),
+        } for entry_id in range(1, tickets // 2 + 1)]
+
+        self.others = {
+            name: [{"id": item_id, "name": "{} {}".format(name, item_id),
+                    "created_at": timestamp(item_id), "updated_at": timestamp(item_id)}
+                   for item_id in range(1, others + 1)]
+            for name in ("agents", "companies", "groups", "roles")
+        }
+
+        # report rows repeat some tickets, as scheduled exports do
+        report_tickets = min(tickets, 1000) if report_tickets is None else report_tickets
+        self.report_ids = [rng.randint(1, max(tickets, 1)) for _ in range(report_tickets)]
+
+    def list_tickets(self, params):
+        listed = params.get("filter")
+        if listed == "deleted":
+            tickets = [ticket for ticket in self.tickets if ticket["deleted"]]
+        elif listed == "spam":
+            tickets = [ticket for ticket in self.tickets if ticket["spam"] and not ticket["deleted"]]
+        else:
+            tickets = [ticket for ticket in self.tickets if not ticket["deleted"] and not ticket["spam"]]
+        since = params.get("updated_since")
+        if since:
+            tickets = [ticket for ticket in tickets if ticket["updated_at"] >= since]
+        return sorted(tickets, key=lambda ticket: (ticket["updated_at"], ticket["id"]))
+
+    def with_includes(self, ticket, includes):
+        ticket = dict(ticket)
+        if "requester" in includes:
+            requester_id = ticket["requester_id"]
+            ticket["requester"] = {"id": requester_id, "name": "Requester {}".format(requester_id % 1000),
+                                   "email": "requester{}@example.com".format(requester_id % 1000),
+                                   "mobile": None, "phone": None}
+        if "company" in includes and ticket["company_id"]:
+            ticket["company"] = {"id": ticket["company_id"], "name": "Company {}".format(ticket["company_id"])}
+        return ticket
+
+    def conversations(self, ticket_id):
+        ticket = self.ticket_by_id.get(ticket_id)
+        if ticket is None:
+            return None
+        return [{"id": ticket_id * 1000 + n, "ticket_id": ticket_id, "incoming": n % 2 == 0,
+                 "private": False, "body": "<div>reply {}</div>".format(n), "body_text": "reply {}".format(n),
+                 "created_at": ticket["updated_at"], "updated_at": ticket["updated_at"]}
+                for n in range(self.conversations_per_ticket)]
+
+    def report_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["Ticket ID", "Subject", "Status", "Priority", "Source", "Agent Name",
+                         "Created Date", "Last Updated Date"])
+        for ticket_id in self.report_ids:
+            ticket = self.ticket_by_id[ticket_id]
+            writer.writerow([ticket_id, ticket["subject"], ticket["status"], ticket["priority"],
+                             ticket["source"], "Agent", ticket["created_at"], ticket["updated_at"]])
+        return out.getvalue().encode("utf-8")
+
+
+FIELDS = {
+    "ticket_fields": [{"name": "subject", "type": "default_subject", "default": True},
+                      {"name": "cf_category", "type": "custom_dropdown", "default": False},
+                      {"name": "cf_account_number", "type": "custom_number", "default": False}],
+    "contact_fields": [{"name": "email", "type": "default_email", "default": True},
+                       {"name": "cf_tier", "type": "custom_dropdown", "default": False}],
+    "company_fields": [{"name": "name", "type": "default_name", "default": True}],
+}
+
+SURVEYS = [{"id": 1, "title": "Default", "questions": [
+    {"id": "default_question", "label": "How would you rate your overall satisfaction?"}]}]
+
+
+class RateLimit:
+    """Per-minute allowance reported the way Freshdesk does, answering 429 once spent."""
+
+    def __init__(self, per_minute=0, throttle_probability=0.0, seed=1):
+        self.per_minute = per_minute
+        self.throttle_probability = throttle_probability
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.minute = None
+        self.used = 0
+
+    def take(self):
+        # returns (headers, retry_after or None)
+        with self.lock:
+            now = time.time()
+            if not self.per_minute:
+                headers = {"X-RateLimit-Total": "100000", "X-RateLimit-Remaining": "100000"}
+            else:
+                minute = int(now // 60)
+                if minute != self.minute:
+                    self.minute, self.used = minute, 0
+                if self.used >= self.per_minute:
+                    retry_after = math.ceil((minute + 1) * 60 - now)
+                    return {"X-RateLimit-Total": str(self.per_minute), "X-RateLimit-Remaining": "0"}, retry_after
+                self.used += 1
+                headers = {"X-RateLimit-Total": str(self.per_minute),
+                           "X-RateLimit-Remaining": str(self.per_minute - self.used)}
+            if self.throttle_probability and self.rng.random() < self.throttle_probability:
+                return headers, 1
+            return headers, None
+
+
+class MockFreshdesk(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dataset, latency=0.0, jitter=0.0, rate_limit=None):
+        super().__init__(address, Handler)
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit or RateLimit()
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = collections.Counter()
+            self.throttled = 0
+
+    def count(self, endpoint, throttled):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.throttled += throttled
+
+
+def page_of(items, params):
+    page = int(params.get("page", 1))
+    per_page = min(int(params.get("per_page", 30)), MAX_PER_PAGE)
+    return items[(page - 1) * per_page:page * per_page]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint = re.sub(r"(?<=/)\d+(?=/|$)", "{id}", url.path.strip("/"))
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if url.path.startswith("/downloads/"):
+            # the export file is served from storage, outside the API's rate limit
+            server.count(endpoint, False)
+            return self.send(200, server.dataset.report_csv(), "text/csv; charset=utf-8")
+
+        headers, retry_after = server.rate_limit.take()
+        server.count(endpoint, retry_after is not None)
+        if retry_after is not None:
+            headers["Retry-After"] = str(retry_after)
+            return self.send(429, {"message": "You have exceeded the limit of requests per minute"},
+                             headers=headers)
+        if int(params.get("page", 1)) > PAGE_LIMIT:
+            return self.send(400, {"description": "Validation failed",
+                                   "errors": [{"field": "page", "code": "invalid_value"}]}, headers=headers)
+
+        status, body = self.route(url.path, params)
+        if url.path.endswith("_fields"):
+            # field definitions never change here, so cached copies are always current
+            headers["ETag"] = '"{}"'.format(url.path.rsplit("/", 1)[-1])
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                return self.send(304, b"", headers=headers)
+        self.send(status, body, headers=headers)
+
+    def route(self, path, params):
+        dataset = self.server.dataset
+        parts = path.strip("/").split("/")
+        if path == "/reports/schedule/download_file.json":
+            return 200, {"export": {"url": self.server.base_url + "downloads/report.csv"}}
+        if parts[:2] != ["api", "v2"]:
+            return 404, {"code": "not_found"}
+        parts = parts[2:]
+
+        if parts == ["tickets"]:
+            includes = params.get("include", "").split(",")
+            return 200, [dataset.with_includes(ticket, includes)
+                         for ticket in page_of(dataset.list_tickets(params), params)]
+        if len(parts) == 2 and parts[0] == "tickets" and parts[1].isdigit():
+            ticket = dataset.ticket_by_id.get(int(parts[1]))
+            return (200, ticket) if ticket else (404, {"code": "not_found"})
+        if len(parts) == 3 and parts[0] == "tickets" and parts[2] == "conversations":
+            conversations = dataset.conversations(int(parts[1]))
+            return (200, page_of(conversations, params)) if conversations is not None else (404, {})
+        if parts == ["contacts"]:
+            since = params.get("_updated_since")
+            contacts = [contact for contact in dataset.contacts if not since or contact["updated_at"] >= since]
+            return 200, page_of(contacts, params)
+        if parts == ["surveys"]:
+            return 200, page_of(SURVEYS, params)
+        if parts == ["surveys", "satisfaction_ratings"]:
+            since = params.get("created_since")
+            ratings = [rating for rating in dataset.ratings if not since or rating["created_at"] >= since]
+            return 200, page_of(ratings, params)
+        if parts == ["time_entries"]:
+            after = params.get("executed_after")
+            entries = [entry for entry in dataset.time_entries if not after or entry["executed_at"] >= after]
+            return 200, page_of(entries, params)
+        if len(parts) == 1 and parts[0] in FIELDS:
+            return 200, FIELDS[parts[0]]
+        if len(parts) == 1 and parts[0] in dataset.others:
+            return 200, page_of(dataset.others[parts[0]], params)
+        return 404, {"code": "not_found"}
+
+
+def add_arguments(parser):
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--conversations-per-ticket", type=int, default=3)
+    parser.add_argument("--contacts", type=int, help="default: half the tickets")
+    parser.add_argument("--ratings", type=int, help="default: a quarter of the tickets")
+    parser.add_argument("--report-tickets", type=int, help="default: up to 1000")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra latency up to this")
+    parser.add_argument("--rate-limit", type=int, default=0,
+                        help="requests per minute before answering 429 (default: unlimited)")
+    parser.add_argument("--throttle-probability", type=float, default=0.0,
+                        help="chance of answering any request with 429 and Retry-After: 1")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def from_arguments(args, host="127.0.0.1", port=0):
+    dataset = Dataset(tickets=args.tickets, conversations_per_ticket=args.conversations_per_ticket,
+                      contacts=args.contacts, ratings=args.ratings, report_tickets=args.report_tickets,
+                      seed=args.seed)
+    return MockFreshdesk((host, port), dataset, latency=args.latency_ms / 1000.0,
+                         jitter=args.jitter_ms / 1000.0,
+                         rate_limit=RateLimit(args.rate_limit, args.throttle_probability, args.seed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, args.host, args.port)
+    print("Serving a mock Freshdesk at {}".format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Runs a full tap-freshdesk discovery and sync against the local mock server
+# and reports throughput, peak memory and API calls per record, e.g.
+#   python benchmarks/run.py --tickets 5000 --latency-ms 20 --tap-config '{"max_workers": 8}'
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock_server
+
+DEFAULT_STREAMS = "tickets,conversations,contacts,satisfaction_ratings,export_report"
+TAP = [sys.executable, "-c", "from tap_freshdesk import main; main()"]
+
+
+def select(catalog, streams):
+    for entry in catalog["streams"]:
+        selected = entry["tap_stream_id"] in streams
+        for mdata in entry["metadata"]:
+            if not mdata["breadcrumb"]:
+                mdata["metadata"]["selected"] = selected
+    return catalog
+
+
+def run_tap(args, stdout, stderr):
+    # peak RSS of this child alone, which RUSAGE_CHILDREN would mix with discovery's
+    process = subprocess.Popen(TAP + args, stdout=stdout, stderr=stderr)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage.ru_maxrss
+
+
+def count_records(path):
+    records = collections.Counter()
+    with open(path) as f:
+        for line in f:
+            if line.startswith('{"type":"RECORD"') or line.startswith('{"type": "RECORD"'):
+                records[json.loads(line)["stream"]] += 1
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    mock_server.add_arguments(parser)
+    parser.add_argument("--streams", default=DEFAULT_STREAMS, help="comma separated streams to select")
+    parser.add_argument("--tap-config", default="{}", help="JSON merged into the tap's config")
+    parser.add_argument("--start-date", default="2022-01-01T00:00:00Z")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the run directory and print its path")
+    args = parser.parse_args()
+
+    server = mock_server.from_arguments(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix="tap-freshdesk-bench-")
+    config = {"domain": "bench", "api_key": "bench", "start_date": args.start_date,
+              "base_url": server.base_url, "report_id": "bench"}
+    config.update(json.loads(args.tap_config))
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    catalog_path = os.path.join(workdir, "catalog.json")
+    with open(catalog_path, "w") as out, open(os.path.join(workdir, "discover.log"), "w") as log:
+        code, _ = run_tap(["-c", config_path, "--discover"], out, log)
+    if code:
+        raise SystemExit("discovery failed, see {}".format(workdir))
+    with open(catalog_path) as f:
+        catalog = select(json.load(f), set(args.streams.split(",")))
+    with open(catalog_path, "w") as f:
+        json.dump(catalog, f)
+
+    server.reset_stats()
+    output_path = os.path.join(workdir, "output.jsonl")
+    started = time.monotonic()
+    with open(output_path, "w") as out, open(os.path.join(workdir, "sync.log"), "w") as log:
+        code, max_rss = run_tap(["-c", config_path, "--catalog", catalog_path], out, log)
+    seconds = time.monotonic() - started
+    if code:
+        raise SystemExit("sync failed, see {}".format(workdir))
+
+    records = count_records(output_path)
+    total = sum(records.values())
+    calls = sum(server.calls.values())
+    results = {
+        "seconds": round(seconds, 3),
+        "records": total,
+        "records_per_second": round(total / seconds, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(max_rss / 1024.0, 1),
+        "api_calls": calls,
+        "api_calls_per_record": round(calls / total, 3) if total else None,
+        "throttled": server.throttled,
+        "streams": dict(sorted(records.items())),
+        "calls": dict(sorted(server.calls.items())),
+    }
+    server.shutdown()
+
+    for stream, count in results["streams"].items():
+        print("{:<24} {:>10} records".format(stream, count))
+    print("{:<24} {:>10} records in {:.1f}s".format("total", total, seconds))
+    print("records/s                {:>10.1f}".format(results["records_per_second"]))
+    print("peak RSS                 {:>10.1f} MB".format(results["peak_rss_mb"]))
+    print("API calls                {:>10} ({} answered 429)".format(calls, server.throttled))
+    print("API calls per record     {:>10}".format(str(results["api_calls_per_record"])))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.keep:
+        print("run directory            {}".format(workdir))
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
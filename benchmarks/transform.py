@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Compares the per-stream RecordTransformer with singer's generic Transformer
+# on synthetic ticket payloads. Run with: python benchmarks/transform.py
+import argparse
+import copy
+import json
+import random
+import time
+
+from singer import Transformer, metadata
+
+from tap_freshdesk.helper import load_schema, map_type
+from tap_freshdesk.transform import RecordTransformer
+
+CUSTOM_FIELDS = {
+    "cf_account_number": "custom_number",
+    "cf_category": "custom_dropdown",
+    "cf_escalated_on": "custom_date_time",
+    "cf_notes": "custom_paragraph",
+    "cf_vip": "custom_checkbox",
+}
+
+
+def ticket_schema():
+    # what discovery produces for tickets: custom fields flattened into the schema
+    schema = load_schema("tickets")
+    for name, field_type in CUSTOM_FIELDS.items():
+        schema["properties"][name] = map_type(field_type)
+    schema["properties"].pop("custom_fields")
+    return schema
+
+
+def ticket_metadata(schema, deselected=("description",)):
+    mdata = metadata.to_map(metadata.get_standard_metadata(schema=schema,
+                                                            key_properties=["id"],
+                                                            valid_replication_keys=["updated_at"],
+                                                            replication_method="INCREMENTAL"))
+    mdata = metadata.write(mdata, (), "selected", True)
+    for field in deselected:
+        mdata = metadata.write(mdata, ("properties", field), "selected", False)
+    return metadata.to_list(mdata)
+
+
+def timestamp(rng):
+    return "2023-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
+        rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+
+
+def ticket(rng, ticket_id):
+    return {
+        "id": ticket_id,
+        "subject": "Ticket {}".format(ticket_id),
+        "description": "<div>{}</div>".format("lorem ipsum " * rng.randint(5, 50)),
+        "description_text": "lorem ipsum " * rng.randint(5, 50),
+        "status": rng.choice([2, 3, 4, 5]),
+        "status_label": "Open",
+        "priority": rng.choice([1, 2, 3, 4]),
+        "priority_label": rng.choice(["Low", False]),
+        "source": rng.choice([1, 2, 3, 7]),
+        "source_label": "Email",
+        "requester_id": rng.randint(1, 10 ** 9),
+        "responder_id": rng.choice([None, rng.randint(1, 10 ** 9)]),
+        "company_id": rng.choice([None, rng.randint(1, 10 ** 6)]),
+        "group_id": None,
+        "product_id": None,
+        "email_config_id": rng.randint(1, 100),
+        "type": rng.choice([None, "Question", "Incident"]),
+        "spam": False,
+        "deleted": rng.choice([False, None]),
+        "is_escalated": rng.choice([True, False]),
+        "fr_escalated": False,
+        "cc_emails": ["cc{}@example.com".format(i) for i in range(rng.randint(0, 3))],
+        "fwd_emails": [],
+        "reply_cc_emails": [],
+        "to_emails": None,
+        "tags": rng.sample(["billing", "vip", "outage", "refund"], rng.randint(0, 3)),
+        "created_at": timestamp(rng),
+        "updated_at": timestamp(rng),
+        "due_by": timestamp(rng),
+        "fr_due_by": timestamp(rng),
+        "requester": {"id": rng.randint(1, 10 ** 9), "name": "Jane Doe", "email": "jane@example.com",
+                      "mobile": None, "phone": "+1 555 0100"},
+        "company": {"id": rng.randint(1, 10 ** 6), "name": "Acme"},
+        "stats": {"agent_responded_at": timestamp(rng), "requester_responded_at": None,
+                  "first_responded_at": timestamp(rng), "status_updated_at": timestamp(rng),
+                  "reopened_at": None, "resolved_at": None, "closed_at": None, "pending_since": None},
+        "custom_fields": {
+            "cf_account_number": rng.choice([None, rng.randint(1, 10 ** 6), "1,234"]),
+            "cf_category": rng.choice([None, "Fibre", "Copper"]),
+            "cf_escalated_on": rng.choice([None, timestamp(rng), "2023-03-01T10:00:00+08:00"]),
+            "cf_notes": rng.choice([None, "", "call back"]),
+            "cf_vip": rng.choice([None, True, False]),
+        },
+        "unknown_field": "not in schema",
+    }
+
+
+def generic(records, schema, stream_metadata):
+    output = []
+    with Transformer() as transformer:
+        for rec in records:
+            custom_fields = rec.get('custom_fields', False)
+            if custom_fields:
+                rec.update(custom_fields)
+                rec.pop('custom_fields')
+            output.append(transformer.transform(rec, schema, metadata.to_map(stream_metadata)))
+    return output
+
+
+def compiled(records, schema, stream_metadata):
+    with RecordTransformer(schema, stream_metadata) as transformer:
+        return [transformer.transform(rec) for rec in records]
+
+
+def timed(fn, records, schema, stream_metadata):
+    records = copy.deepcopy(records)
+    start = time.perf_counter()
+    output = fn(records, schema, stream_metadata)
+    return time.perf_counter() - start, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schema = ticket_schema()
+    stream_metadata = ticket_metadata(schema)
+    records = [ticket(rng, ticket_id) for ticket_id in range(1, args.records + 1)]
+
+    generic_time, expected = timed(generic, records, schema, stream_metadata)
+    compiled_time, actual = timed(compiled, records, schema, stream_metadata)
+
+    identical = [json.dumps(rec) for rec in expected] == [json.dumps(rec) for rec in actual]
+    print("records:           {}".format(args.records))
+    print("singer Transformer {:8.0f} records/s".format(args.records / generic_time))
+    print("RecordTransformer  {:8.0f} records/s".format(args.records / compiled_time))
+    print("speedup            {:8.1f}x".format(generic_time / compiled_time))
+    print("identical output   {}".format(identical))
+    if not identical:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,15 @@ setup(name='tap-freshdesk',
       py_modules=['tap_freshdesk'],
       install_requires=[
           'singer-python==5.9.0',
-          'requests==2.26.0',
-          'backoff==1.8.0'
+          'requests==2.26.0'
       ],
+      extras_require={
+          'fast': ['orjson']
+      },
       entry_points='''
           [console_scripts]
           tap-freshdesk=tap_freshdesk:main
+          tap-freshdesk-multi=tap_freshdesk.multi:main
       ''',
       packages=['tap_freshdesk'],
       package_data={
@@ -0,0 +1,131 @@
+# Run-scoped caches shared by the streams of a sync.
+import collections
+import json
+import sqlite3
+import threading
+
+DEFAULT_RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class LRUCache:
+    """Thread-safe mapping holding at most ``size`` entries.
+
+    The least recently used entry is dropped when the cache is full. A size of
+    zero disables the cache: nothing is stored and every lookup misses.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return self.size > 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class Harvest:
+    """Entities embedded in another stream's records, deduplicated by id.
+
+    Each entity is kept in the version seen on the newest parent record. The
+    parent stream calls ``close`` when it is done, after which ``wait`` returns
+    the entities ordered by id; it raises if the parent stream failed.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.failed = False
+
+    def add(self, entity, version):
+        with self.lock:
+            current = self.entries.get(entity['id'])
+            if current is None or version >= current[0]:
+                self.entries[entity['id']] = (version, entity)
+
+    def close(self, failed=False):
+        # only the first close counts
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.failed = failed
+            self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.failed:
+            raise Exception("The stream these records are taken from failed")
+        with self.lock:
+            return [entity for _, (_, entity) in sorted(self.entries.items())]
+
+
+class ResponseCache:
+    """Run-scoped cache of API responses, bounded in memory and spilled to disk.
+
+    Values are kept JSON encoded, so every ``get`` returns a fresh copy. Once
+    the encoded values held in memory exceed ``max_bytes``, the least recently
+    used ones are moved to a SQLite file, ``path`` or a temporary one, which is
+    emptied when the cache is created.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESPONSE_CACHE_BYTES, path=None):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path or "", check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS responses")
+            self.conn.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def get(self, key):
+        key = json.dumps(key)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            else:
+                row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                value = row and row[0]
+            if value is not None:
+                self.hits += 1
+        return None if value is None else json.loads(value)
+
+    def put(self, key, value):
+        key = json.dumps(key)
+        value = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = value
+            self.size += len(value)
+            spilled = []
+            while self.size > self.max_bytes and self.entries:
+                spilled_key, spilled_value = self.entries.popitem(last=False)
+                self.size -= len(spilled_value)
+                spilled.append((spilled_key, spilled_value))
+            if spilled:
+                with self.conn:
+                    self.conn.executemany("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)",
+                                          spilled)
@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 # Calls to the api are made here.
+import random
 import time
 import singer
-import backoff
 import requests
 from tap_freshdesk import helper
+from tap_freshdesk.metrics import Metrics, endpoint_of
+from tap_freshdesk.cache import LRUCache
+from tap_freshdesk.changes import RecordHashes
+from tap_freshdesk.index import TicketIndex
 from dateutil.relativedelta import relativedelta
 
 logger = singer.get_logger()
 
-ENDPOINT_BASE = "https://{}.freshdesk.com/api/v2/"
+DOMAIN_BASE = "https://{}.freshdesk.com/"
+ENDPOINT_BASE = DOMAIN_BASE + "api/v2/"
 PER_PAGE = 100
 PAGE_LIMIT = 300
+DEFAULT_MAX_WORKERS = 4
+# listings a stream runs at the same time: the tickets stream's filter passes
+CONCURRENT_LISTINGS = 3
+DEFAULT_MAX_TRIES = 5
+DEFAULT_RETRY_BUDGET_SECONDS = 900
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+# errors a request is retried on; other failures, e.g. an invalid URL, are raised right away
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError)
 
 
 # catch all errors and print exception raised
@@ -19,15 +34,64 @@ class FreshdeskError(Exception):
     pass
 
 
-class RateLimitException(Exception):
-    pass
+def retry_after_seconds(resp):
+    # Retry-After is a number of seconds here; without one the backoff delay is used
+    try:
+        return max(float(resp.headers["Retry-After"]), 0.0)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def backoff_delay(failures):
+    # full jitter: anywhere between no wait and the exponential bound
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** failures))
+
+
+def connection_limit(config):
+    # Most requests a client can have in flight: every stream running at once fans
+    # out over max_workers tickets or windows, in each of the ticket filter passes,
+    # and prefetching adds a background fetch for every listing.
+    streams = max(int(config.get("max_stream_concurrency", 1)), 1)
+    workers = max(int(config.get("max_workers", DEFAULT_MAX_WORKERS)), 1)
+    limit = streams * workers * CONCURRENT_LISTINGS
+    if int(config.get("prefetch_pages", 0)) > 0:
+        limit *= 2
+    return limit
+
+
+def make_session(connections, domains=1):
+    session = requests.Session()
+    # one pooled connection per request that can be in flight, so none are thrown away
+    pool_size = max(requests.adapters.DEFAULT_POOLSIZE, connections)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max(requests.adapters.DEFAULT_POOLSIZE, domains), pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 class FreshdeskClient:
-    def __init__(self, config_path, config):
+    def __init__(self, config_path, config, session=None):
         self.config_path = config_path
         self.config = config
-        self.session = requests.Session()
+        self.max_workers = int(config.get("max_workers", DEFAULT_MAX_WORKERS))
+        # clients of several accounts in one process may share a session and its connection pools
+        self.session = session or make_session(connection_limit(config))
+        # ticket ids and updated_at for the child streams, persisted when a path is configured
+        self.ticket_index = TicketIndex(config.get("ticket_index_path"))
+        # tickets returned by the tickets stream in this run, reused by report_tickets
+        self.ticket_cache = LRUCache(int(config.get("ticket_cache_size", 0)))
+        # hashes of the records FULL_TABLE streams emitted before, when change detection is on
+        self.record_hashes = RecordHashes(config.get("change_detection_path"))
+        # objects embedded in tickets collected for side streams, by key; set up by the sync
+        self.sideloads = {}
+        # per-ticket child responses shared by the streams of a run; set up by the sync
+        self.response_cache = None
+        self.rate_limiter = helper.RateLimiter(
+            float(config.get("rate_limit_target", helper.DEFAULT_RATE_LIMIT_TARGET)))
+        self.metrics = Metrics()
+        self.max_tries = int(config.get("max_tries", DEFAULT_MAX_TRIES))
+        self.retry_budget = float(config.get("retry_budget_seconds", DEFAULT_RETRY_BUDGET_SECONDS))
         try:
             # Make an authenticated request after creating the object to any endpoint
             tickets = self.get('tickets', {}, {})
@@ -36,32 +100,73 @@ class FreshdeskClient:
             logger.info("Error initializing FreshdeskClient, please authenticate.")
             raise FreshdeskError(e)
 
-    @backoff.on_exception(backoff.expo,
-                          requests.exceptions.RequestException,
-                          max_tries=5,
-                          giveup=lambda e: e.response is not None and 400 <= e.response.status_code < 500,
-                          factor=2)
-    @backoff.on_exception(backoff.expo, RateLimitException)
-    @helper.ratelimit(1, 2)
     def _make_request_internal(self, full_url=None, params=None, api_key=None, headers=None):
+        # Throttled requests are tried again after exactly the Retry-After the API asks for,
+        # server and connection errors after a jittered exponential backoff. Retrying stops
+        # after max_tries errors or when the next wait would exceed the retry budget; the
+        # last response is then returned, or the last connection error raised.
         req = requests.Request('GET', full_url, params=params, auth=(api_key, ""),
                                headers=headers).prepare()
-        logger.info("GET {}".format(req.url))
-        resp = self.session.send(req)
-        if 'Retry-After' in resp.headers:
-            retry_after = int(resp.headers['Retry-After'])
-            logger.info("Rate limit reached. Sleeping for {} seconds".format(retry_after))
-            time.sleep(retry_after)
-            raise RateLimitException()
-        return resp
+        endpoint = endpoint_of(full_url)
+        deadline = time.monotonic() + self.retry_budget
+        failures = 0
+        while True:
+            self.metrics.rate_limited(self.rate_limiter.acquire())
+            logger.info("GET {}".format(req.url))
+            started = time.monotonic()
+            resp = error = None
+            try:
+                resp = self.session.send(req)
+            except RETRY_ERRORS as e:
+                error = e
+                self.metrics.request(endpoint, time.monotonic() - started, None, 0)
+            else:
+                self.metrics.request(endpoint, time.monotonic() - started, resp.status_code, len(resp.content))
+                self.rate_limiter.update(resp.headers)
+
+            retry_after = None if resp is None else retry_after_seconds(resp)
+            if resp is not None and (resp.status_code == 429 or
+                                     (resp.status_code >= 500 and retry_after is not None)):
+                throttled = True
+                delay = retry_after if retry_after is not None else backoff_delay(1)
+            elif resp is None or resp.status_code >= 500:
+                throttled = False
+                failures += 1
+                delay = backoff_delay(failures)
+            else:
+                return resp
+
+            if (not throttled and failures >= self.max_tries) or time.monotonic() + delay > deadline:
+                if error is not None:
+                    raise error
+                return resp
+            if throttled:
+                logger.info("Rate limit reached. Sleeping for {} seconds".format(delay))
+                self.metrics.retry_after(delay)
+                # every request of this client waits, not only the one that was throttled
+                self.rate_limiter.pause(delay)
+            else:
+                logger.info("Request failed with {}, retrying in {:.1f} seconds".format(
+                    error if error is not None else resp.status_code, delay))
+                self.metrics.retry(delay)
+                time.sleep(delay)
+
     def get_base_url(self,endpoint=None):
+        return self.get_domain_url("api/v2/" + endpoint)
+
+    def get_domain_url(self, path):
+        # for the few resources served outside /api/v2/, e.g. report downloads.
+        # base_url points the tap at another host, e.g. the benchmark's mock server
+        base_url = self.config.get("base_url")
+        if base_url:
+            return base_url.rstrip("/") + "/" + path
         domain = self.config.get("domain", False)
-        return ENDPOINT_BASE.format(domain) + endpoint
-    def _make_request(self, method, endpoint, headers=None, params=None, data=None):
+        return DOMAIN_BASE.format(domain) + path
+
+    def _make_request(self, method, endpoint, headers=None, params=None, data=None, stop_at_page_limit=False):
         params = params or {}
         params["per_page"] = PER_PAGE
         headers = headers or {}
-        page = 1
         domain = self.config.get("domain", False)
         api_key = self.config.get("api_key", False)
         if not domain:
@@ -69,8 +174,7 @@ class FreshdeskClient:
         if not api_key:
             raise FreshdeskError("EXCEPTION RAISED: API KEY not found!")
 
-        updated_at = params.get('updated_since', False) or params.get('_updated_since', )
-        full_url = ENDPOINT_BASE.format(domain) + endpoint
+        full_url = self.get_base_url(endpoint)
         logger.info(
             "%s - Making request to %s endpoint %s, with params %s",
             full_url,
@@ -79,39 +183,60 @@ class FreshdeskClient:
             params,
         )
 
-        try:
-
-            while True:
-                # if page is at its limit, reset page and update search param with updated_at from data's last record
-                if page > PAGE_LIMIT:
-                    logger.info("Reset pagination.")
-                    page = 1
-                    if params.get('updated_since', False):
-                        params['updated_since'] = updated_at
-                    if params.get('_updated_since', False):
-                        params['_updated_since'] = updated_at
-
-                params['page'] = page
-                resp = self._make_request_internal(full_url, params, api_key, headers)
-                resp.raise_for_status()
-
-                response_data = resp.json()
-                # get the last record fetched (ordered asc by updated date)
-                last_record = response_data and response_data[-1]
-                if last_record and 'updated_at' in last_record:
-                    # add one sec to searching date in order to not got the same records twice
-                    updated_at = helper.strptime(last_record['updated_at']) + relativedelta(seconds=1)
-                    updated_at = helper.strftime(updated_at)
-                yield response_data
-
-                if len(resp.json()) == PER_PAGE:
-                    page += 1
-                else:
-                    # no data in the next page
-                    break
+        pages = self._paginate(full_url, params, api_key, headers, stop_at_page_limit)
+        prefetch_pages = int(self.config.get("prefetch_pages", 0))
+        if prefetch_pages > 0:
+            # fetch the next pages in the background while the current one is consumed
+            pages = helper.prefetch(pages, prefetch_pages)
 
-        except Exception as e:
-            raise Exception("EXCEPTION RAISED: ", e)
+        yield from pages
 
-    def get(self, url, headers=None, params=None):
-        yield from self._make_request("GET", url, headers=headers, params=params)
+    def _paginate(self, full_url, params, api_key, headers, stop_at_page_limit=False):
+        page = 1
+        updated_at = params.get('updated_since', False) or params.get('_updated_since', )
+        while True:
+            if page > PAGE_LIMIT and stop_at_page_limit:
+                # the caller narrows the search itself
+                break
+            # if page is at its limit, reset page and update search param with updated_at from data's last record
+            if page > PAGE_LIMIT:
+                logger.info("Reset pagination.")
+                page = 1
+                if params.get('updated_since', False):
+                    params['updated_since'] = updated_at
+                if params.get('_updated_since', False):
+                    params['_updated_since'] = updated_at
+
+            params['page'] = page
+            resp = self._make_request_internal(full_url, params, api_key, headers)
+            resp.raise_for_status()
+
+            response_data = resp.json()
+            # get the last record fetched (ordered asc by updated date)
+            last_record = response_data and response_data[-1]
+            if last_record and 'updated_at' in last_record:
+                # add one sec to searching date in order to not got the same records twice
+                updated_at = helper.strptime(last_record['updated_at']) + relativedelta(seconds=1)
+                updated_at = helper.strftime(updated_at)
+            yield response_data
+
+            if len(response_data) == PER_PAGE:
+                page += 1
+            else:
+                # no data in the next page
+                break
+
+    def get_fields(self, endpoint, etag=None):
+        # Field definitions come in a single response. Returns (fields, etag), or
+        # (None, etag) when the API answers 304 Not Modified to the given etag.
+        headers = {"If-None-Match": etag} if etag else None
+        resp = self._make_request_internal(self.get_base_url(endpoint), None,
+                                           self.config.get("api_key", False), headers)
+        if resp.status_code == 304:
+            return None, etag
+        resp.raise_for_status()
+        return resp.json(), resp.headers.get("ETag")
+
+    def get(self, url, headers=None, params=None, stop_at_page_limit=False):
+        yield from self._make_request("GET", url, headers=headers, params=params,
+                                      stop_at_page_limit=stop_at_page_limit)
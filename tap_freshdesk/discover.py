@@ -1,19 +1,33 @@
 # Discovery code is here.
+import concurrent.futures
+import copy
+import functools
 import os
 import json
+import time
 
+import singer
 from singer import metadata
 from singer.catalog import Catalog
 from .streams import STREAM_OBJECTS
-from .helper import map_type
+from .helper import map_type, read_domain_cache, write_domain_cache
+
+LOGGER = singer.get_logger()
+
+DEFAULT_FIELDS_CACHE_TTL = 3600
 
 
 def _get_abs_path(path):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
 
-# Load schemas from schemas folder
+# Load schemas from schemas folder, once per process; callers get their own copy
 def _load_schemas():
+    return copy.deepcopy(_read_schemas())
+
+
+@functools.lru_cache(maxsize=None)
+def _read_schemas():
     schemas = {}
     for filename in os.listdir(_get_abs_path("schemas")):
         path = _get_abs_path("schemas") + "/" + filename
@@ -23,10 +37,57 @@ def _load_schemas():
     return schemas
 
 
+def _read_fields_cache(path, domain):
+    # {endpoint: {"fetched_at": ..., "etag": ..., "fields": [...]}} of one account
+    entries = read_domain_cache(path, domain) or {}
+    return {endpoint: entry for endpoint, entry in entries.items()
+            if isinstance(entry, dict) and isinstance(entry.get("fields"), list)}
+
+
+def _fetch_fields(client, endpoint, cached):
+    # with the etag of a cached copy the API only sends the fields if they changed
+    etag = cached.get("etag") if cached else None
+    fields, etag = client.get_fields(endpoint, etag)
+    if fields is None:
+        LOGGER.info("Custom fields of %s unchanged", endpoint)
+        fields = cached["fields"]
+    return {"fetched_at": time.time(), "etag": etag, "fields": fields}
+
+
+def get_custom_fields(client, endpoints):
+    # {endpoint: fields} for the custom field endpoints, fetched concurrently.
+    # With custom_fields_cache_path they are kept on disk per domain and reused
+    # for custom_fields_cache_ttl seconds, unless refresh_custom_fields is set.
+    config = client.config
+    path = config.get("custom_fields_cache_path")
+    domain = config.get("domain", "")
+    ttl = float(config.get("custom_fields_cache_ttl", DEFAULT_FIELDS_CACHE_TTL))
+    cached = _read_fields_cache(path, domain) if path else {}
+    if config.get("refresh_custom_fields"):
+        cached = {}
+
+    now = time.time()
+    entries = {endpoint: cached[endpoint] for endpoint in endpoints
+               if endpoint in cached and now - cached[endpoint].get("fetched_at", 0) < ttl}
+    stale = [endpoint for endpoint in endpoints if endpoint not in entries]
+    if stale:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(stale)) as executor:
+            futures = {endpoint: executor.submit(_fetch_fields, client, endpoint, cached.get(endpoint))
+                       for endpoint in stale}
+            for endpoint, future in futures.items():
+                entries[endpoint] = future.result()
+        if path:
+            write_domain_cache(path, domain, entries)
+    return {endpoint: entry["fields"] for endpoint, entry in entries.items()}
+
+
 def discover(client):
     # discover catalog schema
     raw_schemas = _load_schemas()
     catalog_entries = []
+    custom_fields = get_custom_fields(client, sorted({stream.custom_fields
+                                                      for stream in STREAM_OBJECTS.values()
+                                                      if stream.custom_fields}))
 
     for stream_name, schema in raw_schemas.items():
         # create and add catalog entry
@@ -34,18 +95,16 @@ def discover(client):
 
         # Add custom fields
         if stream.custom_fields:
-            response = client._make_request('GET', stream.custom_fields)
-            for page in response:
-                for field in page:
-                    field_name = field.get('name', False)
-                    if field.get('default', False):
-                        continue
-                    # add mapping ex. custom_number -> number
-                    field_type = field.get('type', False)
-                    schema["properties"][field_name] = map_type(field_type)
-                    if field_type == 'nested_field':
-                        for nested_field in field.get('nested_ticket_fields', []):
-                            schema["properties"][nested_field['name']] = map_type(field_type)
+            for field in custom_fields[stream.custom_fields]:
+                field_name = field.get('name', False)
+                if field.get('default', False):
+                    continue
+                # add mapping ex. custom_number -> number
+                field_type = field.get('type', False)
+                schema["properties"][field_name] = map_type(field_type)
+                if field_type == 'nested_field':
+                    for nested_field in field.get('nested_ticket_fields', []):
+                        schema["properties"][nested_field['name']] = map_type(field_type)
             # remove custom_fields parent as they are added directly in schema
             schema["properties"].pop('custom_fields')
 
@@ -1,13 +1,28 @@
 import argparse
+import codecs
 import collections
+import concurrent.futures
 import datetime
-import functools
 import json
 import os
+import queue
+import threading
 import time
 
 DATETIME_FMT = "%Y-%m-%dT%H:%M:%SZ"
 
+# Share of the plan's per-minute allowance the tap is allowed to spend
+DEFAULT_RATE_LIMIT_TARGET = 0.7
+
+# Format version of the JSON files written by write_domain_cache
+CACHE_VERSION = 1
+
+# Guards the state dict, which concurrently running streams share
+STATE_LOCK = threading.RLock()
+DOMAIN_CACHE_LOCK = threading.Lock()
+# longest a caller sleeps before checking the rate limiter's bucket again
+RATE_LIMIT_STEP_SECONDS = 0.1
+
 
 def strptime(dt):
     return datetime.datetime.strptime(dt, DATETIME_FMT)
@@ -17,25 +32,217 @@ def strftime(dt):
     return dt.strftime(DATETIME_FMT)
 
 
-def ratelimit(limit, every):
-    def limitdecorator(fn):
-        times = collections.deque()
-
-        @functools.wraps(fn)
-        def wrapper(*args, **kwargs):
-            if len(times) >= limit:
-                t0 = times.pop()
-                t = time.time()
-                sleep_time = every - (t - t0)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-
-            times.appendleft(time.time())
-            return fn(*args, **kwargs)
-
-        return wrapper
+def next_second(dt):
+    # bookmarks are set one second past the last record so it isn't synced twice
+    return strftime(strptime(dt) + datetime.timedelta(seconds=1))
+
+
+class RateLimiter:
+    """Token bucket whose refill rate is learned from Freshdesk's rate-limit headers.
+
+    X-RateLimit-Total is the plan's per-minute allowance and X-RateLimit-Remaining
+    what is left of it. Only ``target`` of the allowance is ever spent: what is
+    left of it is spread evenly over the rest of the current window, whose start
+    is recognised by the remaining calls going back up. Until the first response
+    is seen the bucket refills at ``rate`` requests per second. ``pause`` holds
+    back every caller until the API's Retry-After has passed.
+    """
+
+    def __init__(self, target=DEFAULT_RATE_LIMIT_TARGET, rate=0.5, window=60):
+        if not 0 < target <= 1:
+            raise ValueError("rate limit target must be in (0, 1], got {}".format(target))
+        self.target = target
+        self.window = window
+        self.min_rate = 1.0 / window
+        self.rate = rate
+        self.capacity = 1.0
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.paused_until = self.last
+        self.budget = None
+        self.window_start = None
+        self.last_remaining = None
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.window_start is not None and now - self.window_start >= self.window:
+            # a new window has begun, with the whole budget to spread over it
+            self.window_start += (now - self.window_start) // self.window * self.window
+            self.rate = max(self.budget / self.window, self.min_rate)
+            self.capacity = max(1.0, self.rate)
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        # Wait for a token in short steps, checking the bucket again after each
+        # one, so a rate raised by a later response is picked up right away.
+        # Returns the time waited on the bucket; Retry-After pauses are accounted for separately.
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                paused = self.paused_until - now
+                if paused <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                due = (1 - self.tokens) / self.rate
+            if paused > 0:
+                time.sleep(paused)
+            else:
+                delay = min(due, RATE_LIMIT_STEP_SECONDS)
+                time.sleep(delay)
+                waited += delay
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        try:
+            total = int(headers["X-RateLimit-Total"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if total <= 0:
+            return
+
+        budget = total * self.target
+        reserve = total - budget
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Responses of concurrent requests arrive slightly out of order, a new window is a
+            # jump. Until one is seen the window is taken to start with the first response; it
+            # can't have started later, so the remaining calls are never spread over too little.
+            if self.window_start is None or remaining > self.last_remaining + total * 0.1:
+                self.window_start = now
+            self.last_remaining = remaining
+            left = self.window - (now - self.window_start)
+            self.budget = budget
+            self.rate = max(max(remaining - reserve, 0) / max(left, 1.0), self.min_rate)
+            self.capacity = max(1.0, self.rate)
+
+
+def ordered_map(fn, iterable, workers):
+    # Run fn over iterable with a bounded number of calls in flight and yield
+    # the results in input order, so output stays grouped and deterministic.
+    if workers <= 1:
+        for item in iterable:
+            yield fn(item)
+        return
 
-    return limitdecorator
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def prefetch(iterable, depth):
+    # Consume iterable on a background thread, keeping up to depth items ready
+    # ahead of the caller. Errors are re-raised in the caller's thread.
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def interleave(iterables):
+    # Consume each iterable on its own thread and yield items as they arrive.
+    # A producer only moves on once the caller has come back for the next item,
+    # so whatever it does between items never runs ahead of the caller.
+    items = queue.Queue()
+    stop = threading.Event()
+    done = object()
+    acks = [threading.Event() for _ in iterables]
+
+    def produce(iterable, ack):
+        try:
+            for item in iterable:
+                items.put((item, None, ack))
+                ack.wait()
+                ack.clear()
+                if stop.is_set():
+                    return
+            items.put((done, None, None))
+        except Exception as e:
+            items.put((None, e, None))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    for iterable, ack in zip(iterables, acks):
+        threading.Thread(target=produce, args=(iterable, ack), daemon=True).start()
+    try:
+        remaining = len(acks)
+        while remaining:
+            item, error, ack = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
+            ack.set()
+    finally:
+        stop.set()
+        for ack in acks:
+            ack.set()
+
+
+def iter_lines(chunks, encoding):
+    # Decode a stream of byte chunks incrementally and yield complete lines,
+    # keeping the line endings so csv can rebuild quoted multi-line fields.
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
 
 
 def chunk(l, n):
@@ -56,6 +263,38 @@ def load_schema(entity):
     return load_json(get_abs_path("schemas/{}.json".format(entity)))
 
 
+def read_domain_cache(path, domain):
+    # what write_domain_cache stored for the account, None if there is nothing usable
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        return None
+    return cache.get("domains", {}).get(domain)
+
+
+def write_domain_cache(path, domain, value):
+    # JSON cache files hold one entry per Freshdesk account, so several
+    # accounts can share one file
+    # accounts synced on threads of one process would otherwise drop each other's entries
+    with DOMAIN_CACHE_LOCK:
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+            if cache.get("version") != CACHE_VERSION:
+                raise ValueError
+        except (OSError, ValueError, AttributeError):
+            cache = {"version": CACHE_VERSION, "domains": {}}
+        cache["domains"][domain] = value
+        # write next to the cache and swap, so a concurrent run never reads half a file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+
+
 def update_state(state, entity, dt):
     if dt is None:
         return
@@ -63,11 +302,12 @@ def update_state(state, entity, dt):
     if isinstance(dt, datetime.datetime):
         dt = strftime(dt)
 
-    if entity not in state:
-        state[entity] = dt
+    with STATE_LOCK:
+        if entity not in state:
+            state[entity] = dt
 
-    if dt > state[entity]:
-        state[entity] = dt
+        if dt > state[entity]:
+            state[entity] = dt
 
 
 def parse_args(required_config_keys):
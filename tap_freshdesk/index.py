@@ -0,0 +1,137 @@
+# Disk-backed ticket index shared by the ticket child streams.
+import hashlib
+import itertools
+import sqlite3
+import threading
+
+BATCH_SIZE = 1000
+
+
+class TicketIndex:
+    """SQLite index of ticket ids and their latest ``updated_at``.
+
+    The index is filled from ticket listings and remembers the range of
+    ``updated_at`` values it covers completely, so child streams can ask for
+    "tickets updated since X" after listing only what changed since the last
+    refresh. With a ``path`` it persists across runs, otherwise SQLite keeps it
+    in a temporary file that is removed when the process exits.
+
+    It also holds the ticket ids of the current run's export report.
+    """
+
+    def __init__(self, path=None):
+        self.conn = sqlite3.connect(path or "", check_same_thread=False)
+        self.lock = threading.Lock()
+        self.report_lock = threading.Lock()
+        self.report_loaded = False
+        with self.lock, self.conn:
+            if path:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tickets "
+                              "(id INTEGER PRIMARY KEY, updated_at TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tickets_updated_at "
+                              "ON tickets (updated_at, id)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS coverage "
+                              "(id INTEGER PRIMARY KEY CHECK (id = 0), "
+                              "covered_from TEXT, covered_until TEXT)")
+            self.conn.execute("CREATE TEMP TABLE report_tickets (id INTEGER PRIMARY KEY)")
+            self.conn.execute("CREATE TEMP TABLE report_tickets_staging (id INTEGER PRIMARY KEY)")
+
+    def add(self, records):
+        rows = [(rec['id'], rec['updated_at']) for rec in records]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO tickets (id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at "
+                "WHERE excluded.updated_at > tickets.updated_at", rows)
+
+    def updated_at(self, ticket_id):
+        with self.lock:
+            row = self.conn.execute("SELECT updated_at FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        return row and row[0]
+
+    def coverage(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT covered_from, covered_until FROM coverage WHERE id = 0").fetchone()
+        return row or (None, None)
+
+    def refresh_start(self, start_date):
+        # where a listing has to begin so the index covers start_date onwards
+        covered_from, covered_until = self.coverage()
+        if covered_from is None or start_date < covered_from:
+            return start_date
+        return max(covered_until, start_date)
+
+    def mark_covered(self, since, until):
+        # a listing from `since` ran to completion; the last record it saw was at `until`
+        covered_from, covered_until = self.coverage()
+        until = max(until, since)
+        if covered_from is None or covered_until < since:
+            covered_from, covered_until = since, until
+        else:
+            covered_from, covered_until = min(covered_from, since), max(covered_until, until)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO coverage (id, covered_from, covered_until) "
+                              "VALUES (0, ?, ?)", (covered_from, covered_until))
+
+    def updated_since(self, start_date):
+        # (id, updated_at) ordered by updated_at, read in batches so nothing is held open
+        last_updated_at, last_id = start_date, None
+        while True:
+            with self.lock:
+                if last_id is None:
+                    rows = self.conn.execute(
+                        "SELECT id, updated_at FROM tickets WHERE updated_at >= ? "
+                        "ORDER BY updated_at, id LIMIT ?", (last_updated_at, BATCH_SIZE)).fetchall()
+                else:
+                    rows = self.conn.execute(
+                        "SELECT id, updated_at FROM tickets WHERE (updated_at, id) > (?, ?) "
+                        "ORDER BY updated_at, id LIMIT ?",
+                        (last_updated_at, last_id, BATCH_SIZE)).fetchall()
+            yield from rows
+            if len(rows) < BATCH_SIZE:
+                return
+            last_id, last_updated_at = rows[-1]
+
+    def begin_report(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM report_tickets_staging")
+
+    def add_report_tickets(self, ticket_ids):
+        ticket_ids = iter(ticket_ids)
+        while True:
+            batch = list(itertools.islice(ticket_ids, BATCH_SIZE))
+            if not batch:
+                return
+            rows = [(int(ticket_id),) for ticket_id in batch if str(ticket_id).strip()]
+            with self.lock, self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO report_tickets_staging (id) VALUES (?)", rows)
+
+    def commit_report(self):
+        # publish the staged ids once the whole report has been read
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM report_tickets")
+            self.conn.execute("INSERT INTO report_tickets SELECT id FROM report_tickets_staging")
+            self.conn.execute("DELETE FROM report_tickets_staging")
+        self.report_loaded = True
+
+    def report_fingerprint(self):
+        # identifies the set of report tickets, so saved progress is only resumed on the same report
+        digest = hashlib.sha1()
+        for ticket_id in self.report_ticket_ids():
+            digest.update(b"%d," % ticket_id)
+        return digest.hexdigest()
+
+    def report_ticket_ids(self):
+        # sorted, de-duplicated ids of the report tickets
+        last_id = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT id FROM report_tickets WHERE id > ? ORDER BY id LIMIT ?",
+                                         (last_id, BATCH_SIZE)).fetchall()
+            for (ticket_id,) in rows:
+                yield ticket_id
+            if len(rows) < BATCH_SIZE:
+                return
+            last_id = rows[-1][0]
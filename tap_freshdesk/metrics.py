@@ -0,0 +1,153 @@
+# Counters and timings collected over a run, reported as singer metrics.
+import bisect
+import collections
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import singer
+from singer.metrics import Point, log
+
+LOGGER = singer.get_logger()
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+def endpoint_of(url):
+    # "https://x.freshdesk.com/api/v2/tickets/12/conversations" -> "tickets/{id}/conversations"
+    path = urlparse(url).path
+    if path.startswith("/api/v2/"):
+        path = path[len("/api/v2/"):]
+    return re.sub(r"(?<=/)\d+(?=/|$)", "{id}", path.strip("/"))
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latency = [0] * len(LATENCY_BUCKETS)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "latency": {("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in zip(LATENCY_BUCKETS, self.latency)},
+        }
+
+
+class StreamStats:
+    def __init__(self):
+        self.records = 0
+        self.seconds = 0.0
+        self.transform_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "records": self.records,
+            "seconds": round(self.seconds, 3),
+            "records_per_second": round(self.records / self.seconds, 1) if self.seconds else None,
+            "transform_seconds": round(self.transform_seconds, 3),
+            "write_seconds": round(self.write_seconds, 3),
+        }
+
+
+class Metrics:
+    """Where a run spends its time, shared by the client and every stream.
+
+    Requests are counted per endpoint, with ids in the path collapsed so e.g.
+    all ``tickets/{id}/conversations`` calls land together. Time spent waiting
+    on the rate limiter, on ``Retry-After`` and in retries is counted
+    separately. Each request and each finished stream is logged as a singer
+    metric, and ``summary`` returns the totals for the end-of-run report.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.endpoints = collections.defaultdict(EndpointStats)
+        self.streams = collections.defaultdict(StreamStats)
+        self.rate_limit_seconds = 0.0
+        self.retry_after_seconds = 0.0
+        self.retry_after_count = 0
+        self.retries = 0
+        self.retry_seconds = 0.0
+
+    def request(self, endpoint, seconds, status, nbytes):
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats.requests += 1
+            stats.errors += status is None or status >= 400
+            stats.bytes += nbytes
+            stats.seconds += seconds
+            stats.latency[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        log(LOGGER, Point("timer", "http_request_duration", seconds,
+                          {"endpoint": endpoint, "http_status_code": status,
+                           "status": "succeeded" if status and status < 400 else "failed"}))
+
+    def received(self, endpoint, nbytes):
+        # bytes of responses read after the request was counted, e.g. streamed downloads
+        with self.lock:
+            self.endpoints[endpoint].bytes += nbytes
+
+    def rate_limited(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.rate_limit_seconds += seconds
+
+    def retry_after(self, seconds):
+        with self.lock:
+            self.retry_after_count += 1
+            self.retry_after_seconds += seconds
+
+    def retry(self, seconds):
+        with self.lock:
+            self.retries += 1
+            self.retry_seconds += seconds
+
+    def stream(self, stream_id, records, seconds, transform_seconds, write_seconds):
+        with self.lock:
+            stats = self.streams[stream_id]
+            stats.records += records
+            stats.seconds += seconds
+            stats.transform_seconds += transform_seconds
+            stats.write_seconds += write_seconds
+        tags = {"endpoint": stream_id}
+        log(LOGGER, Point("counter", "record_count", records, tags))
+        log(LOGGER, Point("timer", "stream_duration", seconds, tags))
+        log(LOGGER, Point("timer", "transform_duration", transform_seconds, tags))
+        log(LOGGER, Point("timer", "write_duration", write_seconds, tags))
+
+    def summary(self):
+        with self.lock:
+            return {
+                "seconds": round(time.monotonic() - self.started, 3),
+                "requests": sum(stats.requests for stats in self.endpoints.values()),
+                "bytes": sum(stats.bytes for stats in self.endpoints.values()),
+                "rate_limit_sleep_seconds": round(self.rate_limit_seconds, 3),
+                "retry_after": {"count": self.retry_after_count,
+                                "seconds": round(self.retry_after_seconds, 3)},
+                "retries": {"count": self.retries, "seconds": round(self.retry_seconds, 3)},
+                "endpoints": {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())},
+                "streams": {name: stats.as_dict() for name, stats in sorted(self.streams.items())},
+            }
+
+    def report(self, path=None):
+        summary = self.summary()
+        LOGGER.info("Run summary: %s requests, %s bytes, %.1fs waiting on the rate limit, "
+                    "%s Retry-After (%.1fs), %s retries",
+                    summary["requests"], summary["bytes"], summary["rate_limit_sleep_seconds"],
+                    summary["retry_after"]["count"], summary["retry_after"]["seconds"],
+                    summary["retries"]["count"])
+        if path:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+        return summary
@@ -0,0 +1,132 @@
+# Syncs several Freshdesk accounts in one process.
+import argparse
+import concurrent.futures
+import json
+import os
+
+import singer
+from singer import utils
+from singer.catalog import Catalog
+
+from tap_freshdesk import helper, output
+from tap_freshdesk.client import FreshdeskClient, connection_limit, make_session
+from tap_freshdesk.discover import discover
+from tap_freshdesk.sync import sync
+
+LOGGER = singer.get_logger()
+
+REQUIRED_TENANT_KEYS = ['name', 'api_key', 'domain', 'start_date']
+# keys of the multi-tenant config that aren't passed on to the tenants
+MULTI_KEYS = ['tenants', 'output_dir', 'max_tenants']
+TENANT_KEYS = ['name', 'state', 'catalog']
+# files holding a single account's data; when set for all tenants each gets its own
+TENANT_PATH_KEYS = ['ticket_index_path', 'change_detection_path', 'response_cache_path',
+                    'metrics_summary_path']
+DEFAULT_MAX_TENANTS = 4
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help='Multi-tenant config file', required=True)
+    parser.add_argument('--catalog', help='Catalog file used for tenants without their own')
+    parser.add_argument('-d', '--discover', action='store_true', help='Write a catalog per tenant')
+    return parser.parse_args()
+
+
+def tenant_path(path, name):
+    # "/data/index.db" -> "/data/index.acme.db"
+    root, ext = os.path.splitext(path)
+    return "{}.{}{}".format(root, name, ext)
+
+
+def tenant_configs(config):
+    # the top-level keys are defaults that every tenant may override
+    defaults = {key: value for key, value in config.items() if key not in MULTI_KEYS}
+    names = set()
+    paths = {}
+    for tenant in config.get('tenants') or []:
+        tenant_config = dict(defaults, **tenant)
+        helper.check_config(tenant_config, REQUIRED_TENANT_KEYS)
+        name = tenant_config['name']
+        if name in names:
+            raise Exception("Tenant name {} is used more than once".format(name))
+        names.add(name)
+        for key in TENANT_PATH_KEYS:
+            if key in defaults and key not in tenant:
+                tenant_config[key] = tenant_path(defaults[key], name)
+            path = tenant_config.get(key)
+            if path:
+                path = os.path.abspath(path)
+                if path in paths:
+                    raise Exception("Tenants {} and {} both use {} for {}".format(
+                        paths[path], name, tenant_config[key], key))
+                paths[path] = name
+        yield tenant_config
+
+
+def write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def run_tenant(tenant_config, session, output_dir, catalog_path, discover_mode):
+    name = tenant_config['name']
+    config = {key: value for key, value in tenant_config.items() if key not in TENANT_KEYS}
+    # each tenant has its own client, and with it its own rate limiter, metrics and stores
+    client = FreshdeskClient(None, config, session=session)
+    if discover_mode:
+        LOGGER.info("Starting discovery of tenant %s", name)
+        catalog = discover(client)
+        write_json(os.path.join(output_dir, name + ".catalog.json"), catalog.to_dict())
+        return
+
+    catalog_path = tenant_config.get('catalog') or catalog_path
+    if not catalog_path:
+        raise Exception("No catalog for tenant {}".format(name))
+    catalog = Catalog.load(catalog_path)
+    state = helper.load_json(tenant_config['state']) if tenant_config.get('state') else {}
+
+    LOGGER.info("Starting sync of tenant %s", name)
+    with open(os.path.join(output_dir, name + ".jsonl"), "w") as out:
+        try:
+            sync(client, config, state, catalog, output.Writer.from_config(config, out))
+        finally:
+            # where the tenant's next run starts from, including after a failure
+            write_json(os.path.join(output_dir, name + ".state.json"), state)
+
+
+@utils.handle_top_exception(LOGGER)
+def main():
+    args = parse_args()
+    config = helper.load_json(args.config)
+    tenants = list(tenant_configs(config))
+    output_dir = config.get('output_dir', '.')
+    os.makedirs(output_dir, exist_ok=True)
+
+    max_tenants = min(int(config.get('max_tenants', DEFAULT_MAX_TENANTS)), len(tenants)) or 1
+    # connection pools are shared; rate limiting, retries and output stay per tenant, so one
+    # throttled account only holds up its own thread while the others carry on. Tenants running
+    # at the same time can share a host, e.g. a base_url, so their limits add up.
+    limits = sorted((connection_limit(tenant) for tenant in tenants), reverse=True)
+    session = make_session(sum(limits[:max_tenants]), domains=len(tenants))
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_tenants) as executor:
+        futures = {executor.submit(run_tenant, tenant, session, output_dir, args.catalog, args.discover):
+                   tenant['name'] for tenant in tenants}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+                LOGGER.info("Finished tenant %s", name)
+            except Exception:
+                LOGGER.exception("Tenant %s failed", name)
+                failed.append(name)
+    if failed:
+        raise Exception("Tenants failed: {}".format(", ".join(sorted(failed))))
+
+
+if __name__ == "__main__":
+    main()
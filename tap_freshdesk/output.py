@@ -0,0 +1,177 @@
+# Singer messages from every stream are written through here.
+import sys
+import threading
+import time
+
+import simplejson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from tap_freshdesk import helper
+
+DEFAULT_BUFFER_BYTES = 64 * 1024
+DEFAULT_FLUSH_SECONDS = 1.0
+
+# same encoding singer uses, kept around instead of being rebuilt per message
+ENCODER = simplejson.JSONEncoder(use_decimal=True)
+
+
+def dumps(message):
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode()
+        except TypeError:
+            # e.g. Decimal or integers beyond 64 bits, which singer's encoder handles
+            pass
+    return ENCODER.encode(message)
+
+
+class Writer:
+    """Serializes SCHEMA, RECORD and STATE messages onto a single output.
+
+    Streams may run on different threads; messages are appended to one buffer
+    under a lock, so lines are never interleaved and a STATE message always
+    follows the records it covers. The buffer is written out once it holds
+    ``buffer_bytes`` or ``flush_seconds`` have passed since the last write; a
+    background thread makes sure of the latter when no further messages come,
+    e.g. during a long Retry-After. With ``buffer_bytes=0`` every message is
+    written and flushed right away. ``close`` writes out what is left.
+    """
+
+    def __init__(self, out=None, buffer_bytes=0, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.out = out
+        self.buffer_bytes = buffer_bytes
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        self.flushed_at = time.monotonic()
+        self.timer = None
+        self.stopped = None
+
+    @classmethod
+    def from_config(cls, config, out=None):
+        return cls(out,
+                   buffer_bytes=int(config.get("output_buffer_bytes", DEFAULT_BUFFER_BYTES)),
+                   flush_seconds=float(config.get("output_flush_seconds", DEFAULT_FLUSH_SECONDS)))
+
+    def _flush(self):
+        out = self.out or sys.stdout
+        if self.buffer:
+            out.write("".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        out.flush()
+        self.flushed_at = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.stopped.set()
+                self.timer = None
+            self._flush()
+
+    def _flush_when_due(self, stopped):
+        # runs on the timer thread until the writer is closed
+        delay = self.flush_seconds
+        while not stopped.wait(delay):
+            with self.lock:
+                delay = self.flushed_at + self.flush_seconds - time.monotonic()
+                if self.buffer and delay <= 0:
+                    self._flush()
+                if not self.buffer or delay <= 0:
+                    delay = self.flush_seconds
+
+    def write_line(self, line):
+        with self.lock:
+            self.buffer.append(line + '\n')
+            self.buffered += len(line) + 1
+            if (self.buffered >= self.buffer_bytes
+                    or time.monotonic() - self.flushed_at >= self.flush_seconds):
+                self._flush()
+            elif self.timer is None:
+                # something is held back now, which has to go out within flush_seconds
+                self.stopped = threading.Event()
+                self.timer = threading.Thread(target=self._flush_when_due, args=(self.stopped,),
+                                              daemon=True)
+                self.timer.start()
+
+    def write_message(self, message):
+        self.write_line(dumps(message.asdict()))
+
+    def write_schema(self, stream_name, schema, key_properties, bookmark_properties=None):
+        message = {"type": "SCHEMA", "stream": stream_name, "schema": schema,
+                   "key_properties": key_properties}
+        if bookmark_properties:
+            message["bookmark_properties"] = bookmark_properties
+        self.write_line(dumps(message))
+
+    def write_record(self, stream_name, record):
+        self.write_line(dumps({"type": "RECORD", "stream": stream_name, "record": record}))
+
+    def write_state(self, value):
+        # other streams may be updating their bookmarks in the same dict
+        with helper.STATE_LOCK:
+            line = dumps({"type": "STATE", "value": value})
+        self.write_line(line)
+
+
+class Checkpointer:
+    """Decides when a stream writes its state.
+
+    Streams call ``checkpoint`` whenever the bookmarks in the state are safe to
+    resume from, passing the number of records emitted since the last call and
+    whether this is the end of a page. By default state is written at the end
+    of every page. With ``every_records`` and/or ``every_seconds`` it is written
+    once either threshold is reached, and with ``at_end_only`` only by
+    ``finish`` when the stream is done.
+    """
+
+    def __init__(self, writer, state, every_records=0, every_seconds=0, at_end_only=False):
+        self.writer = writer
+        self.state = state
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.at_end_only = at_end_only
+        self.records = 0
+        self.dirty = False
+        self.written_at = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config, writer, state):
+        return cls(writer, state,
+                   every_records=int(config.get("checkpoint_every_records", 0)),
+                   every_seconds=float(config.get("checkpoint_every_seconds", 0)),
+                   at_end_only=bool(config.get("checkpoint_at_end_only", False)))
+
+    def due(self, page_end):
+        if self.at_end_only:
+            return False
+        if not self.every_records and not self.every_seconds:
+            return page_end
+        if self.every_records and self.records >= self.every_records:
+            return True
+        return bool(self.every_seconds) and time.monotonic() - self.written_at >= self.every_seconds
+
+    def checkpoint(self, records=0, page_end=True):
+        self.records += records
+        self.dirty = True
+        if self.due(page_end):
+            self.write()
+
+    def write(self):
+        self.writer.write_state(self.state)
+        self.records = 0
+        self.dirty = False
+        self.written_at = time.monotonic()
+
+    def finish(self):
+        if self.dirty:
+            self.write()
@@ -1,20 +1,83 @@
 # If using the class-based model, this is where all the stream classes and their corresponding functions live.
+import copy
 import singer
 import datetime
-from tap_freshdesk import helper
-import requests
+import time
+from tap_freshdesk import helper, output, windows
+from tap_freshdesk.client import PER_PAGE
 import csv
-from io import StringIO
+import itertools
 
 LOGGER = singer.get_logger()
 
+# objects the ticket listing embeds on request, which GET tickets/{id} doesn't return
+TICKET_INCLUDES = ("requester", "company", "stats")
+
 
 class Stream:
-    def __init__(self, client, config, state):
+    # FULL_TABLE streams that only emit new and changed records when change detection is on
+    change_detection = False
+    # key of the object embedded in tickets that side streams are filled from
+    sideload = None
+    # fields deselected in the catalog, set by the sync before the stream runs
+    deselected = frozenset()
+
+    def __init__(self, client, config, state, writer=None):
         self.client = client
         self.config = config
         self.state = state
-
+        self.writer = writer or output.Writer()
+        self.checkpointer = output.Checkpointer.from_config(config, self.writer, state)
+
+    def is_selected(self, field):
+        return field not in self.deselected
+
+    def project(self, records, keep=()):
+        # drop deselected fields right after decoding, before any other work on the records
+        fields = self.deselected.difference(keep)
+        if not fields:
+            return records
+        for rec in records:
+            for field in fields:
+                rec.pop(field, None)
+            custom_fields = rec.get('custom_fields')
+            if isinstance(custom_fields, dict):
+                for field in fields:
+                    custom_fields.pop(field, None)
+        return records
+
+    def resume_position(self, fingerprint):
+        # position of the last ticket an interrupted run over the same tickets finished
+        saved = self.state.get(PROGRESS_KEY, {}).get(self.stream_id)
+        if saved and saved.get("fingerprint") == fingerprint:
+            LOGGER.info("Resuming {} after {}".format(self.stream_id, saved["position"]))
+            return saved["position"]
+        return None
+
+    def save_progress(self, fingerprint, position):
+        with helper.STATE_LOCK:
+            self.state.setdefault(PROGRESS_KEY, {})[self.stream_id] = {"fingerprint": fingerprint,
+                                                                        "position": position}
+
+    def clear_progress(self):
+        with helper.STATE_LOCK:
+            progress = self.state.get(PROGRESS_KEY, {})
+            if progress.pop(self.stream_id, None) is not None and not progress:
+                self.state.pop(PROGRESS_KEY)
+
+    def save_bookmark(self, last_value):
+        # for listings that aren't ordered by the replication key: the bookmark
+        # only moves once the whole listing was emitted
+        if last_value:
+            helper.update_state(self.state, self.stream_id, helper.next_second(last_value))
+            self.checkpointer.checkpoint()
+
+
+CSV_CHUNK_SIZE = 64 * 1024
+# state[PROGRESS_KEY][stream] holds how far an unfinished child stream got through its tickets
+PROGRESS_KEY = "progress"
+# the export itself is served from a signed storage url, counted under this name
+DOWNLOAD_ENDPOINT = "reports/download"
 
 TICKET_SCOPE = {
     1: "Global Access",
@@ -31,6 +94,7 @@ class Agents(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
+    change_detection = True
 
     def sync(self, start_date):
         for page in self.client.get(self.endpoint, params={}):
@@ -46,13 +110,21 @@ class Companies(Stream):
 
     custom_fields = 'company_fields'
     key_properties = ["id"]
-    replication_method = "FULL_TABLE"
-    replication_keys = []
+    replication_method = "INCREMENTAL"
+    replication_keys = ["updated_at"]
 
     def sync(self, start_date):
+        # companies can't be listed by date, so the ones not updated since the bookmark are dropped here
+        last_updated_at = None
         for page in self.client.get(self.endpoint, params={}):
             for rec in page:
+                updated_at = rec.get('updated_at')
+                if updated_at and updated_at < start_date:
+                    continue
+                if updated_at:
+                    last_updated_at = max(last_updated_at or updated_at, updated_at)
                 yield rec
+        self.save_bookmark(last_updated_at)
 
 
 class Contacts(Stream):
@@ -68,7 +140,7 @@ class Contacts(Stream):
         params = {'_updated_since': start_date}
         pages = self.client.get(self.endpoint, params=params)
         for page in pages:
-            for rec in page:
+            for rec in self.project(page):
                 if rec['updated_at'] >= start_date:
                     # updated with one second to not get doubled records for the same datetime
                     start_date = rec['updated_at']
@@ -77,7 +149,7 @@ class Contacts(Stream):
             start_date = helper.strftime(start_date)
 
             helper.update_state(self.state, self.stream_id, start_date)
-            singer.write_state(self.state)
+            self.checkpointer.checkpoint(len(page))
 
 
 class Groups(Stream):
@@ -88,6 +160,7 @@ class Groups(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
+    change_detection = True
 
     def sync(self, start_date):
         for page in self.client.get(self.endpoint, params={}):
@@ -103,6 +176,7 @@ class Roles(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
+    change_detection = True
 
     def sync(self, start_date):
         for page in self.client.get(self.endpoint, params={}):
@@ -135,6 +209,10 @@ PRIORITY = {
 }
 
 
+# "" lists the tickets that are neither deleted nor spam
+TICKET_FILTERS = ["", "deleted", "spam"]
+
+
 class Tickets(Stream):
     stream_id = 'tickets'
     stream_name = 'tickets'
@@ -144,48 +222,140 @@ class Tickets(Stream):
     replication_method = "INCREMENTAL"
     replication_keys = ['updated_at']
 
-    ticket_ids = []
-
-    def get_all_ticket_ids(self):
-        if Tickets.ticket_ids:
-            for ticket in Tickets.ticket_ids:
-                yield ticket
-        else:
-            for page in self.client.get(self.endpoint):
-                for rec in page:
-                    Tickets.ticket_ids.append(rec['id'])
-                    yield rec['id']
-
-    def sync(self, start_date):
+    def get_updated_tickets(self, start_date):
+        # (id, updated_at) of the tickets updated since start_date, oldest first.
+        # Only what changed since the ticket index was last refreshed is listed.
+        index = self.client.ticket_index
+        since = index.refresh_start(start_date)
         params = {
-            'updated_since': start_date,
+            'updated_since': since,
             'order_by': 'updated_at',
             'order_type': "asc",
-            'include': "requester,company,stats"
         }
-
-        for predefined_filter in ["", "deleted", "spam"]:
-            LOGGER.info("Syncing tickets with filter {}".format(predefined_filter))
-            stream = self.stream_id
-            if predefined_filter:
-                params['filter'] = predefined_filter
-                stream = params['filter'] + "_" + stream
+        last_updated_at = since
+        for page in self.client.get(self.endpoint, params=params):
+            index.add(page)
+            if page:
+                last_updated_at = max(last_updated_at, page[-1]['updated_at'])
+        index.mark_covered(since, last_updated_at)
+        yield from index.updated_since(start_date)
+
+    def get_include(self):
+        # embedded objects are only requested when something reads them
+        include = [key for key in TICKET_INCLUDES
+                   if self.is_selected(key) or key in self.client.sideloads]
+        if self.client.ticket_cache:
+            # cached tickets stand in for GET tickets/{id}, which returns the description
+            include.append("description")
+        return include
+
+    def list_filter(self, predefined_filter, start_date, window_size):
+        # One filter pass, yielding (state key, page, bookmark after the page).
+        # Deleted records only show on the filtered calls; every filter keeps its
+        # own bookmark and falls back to the tickets one.
+        stream = predefined_filter + "_" + self.stream_id if predefined_filter else self.stream_id
+        pass_start = last_updated_at = self.state.get(stream, start_date)
+        LOGGER.info("Syncing tickets with filter {} from {}".format(predefined_filter, pass_start))
+        params = {
+            'updated_since': pass_start,
+            'order_by': 'updated_at',
+            'order_type': "asc",
+        }
+        include = self.get_include()
+        if include:
+            params['include'] = ",".join(include)
+        if predefined_filter:
+            params['filter'] = predefined_filter
+
+        listing = None
+        if window_size:
+            listing = windows.WindowedListing(self.client, self.endpoint, params, 'updated_since',
+                                              self.state, stream, window_size)
+            page_generator = listing.pages(pass_start, self.client.max_workers)
+        else:
             page_generator = self.client.get(self.endpoint, params=params)
 
-            # Get filtered record, as deleted records won't show on unfiltered call
-            for page in page_generator:
+        sideloads = list(self.client.sideloads.items())
+        # the labels are worked out from these, side streams read the embedded objects
+        keep = ['source', 'status', 'priority'] + [key for key, _ in sideloads]
+        for page in page_generator:
+            if not predefined_filter:
+                self.client.ticket_index.add(page)
+            if self.client.ticket_cache:
+                # report tickets get the ticket as GET tickets/{id} returns it, not as emitted here
                 for rec in page:
-                    rec.pop('attachments', None)
-                    rec['source_label'] = SOURCE.get(rec.get('source', False), False)
-                    rec['status_label'] = STATUS.get(rec.get('status', False), False)
-                    rec['priority_label'] = PRIORITY.get(rec.get('priority', False), False)
-                    start_date = rec['updated_at']
-                    yield rec
-                start_date = helper.strptime(start_date) + datetime.timedelta(seconds=1)
-                start_date = helper.strftime(start_date)
+                    self.client.ticket_cache.put(rec['id'], copy.deepcopy(
+                        {key: value for key, value in rec.items() if key not in TICKET_INCLUDES}))
+            self.project(page, keep)
+            for rec in page:
+                for key, harvest in sideloads:
+                    embedded = rec.get(key)
+                    if embedded and embedded.get('id') is not None:
+                        harvest.add(dict(embedded), rec['updated_at'])
+                rec.pop('attachments', None)
+                rec['source_label'] = SOURCE.get(rec.get('source', False), False)
+                rec['status_label'] = STATUS.get(rec.get('status', False), False)
+                rec['priority_label'] = PRIORITY.get(rec.get('priority', False), False)
+                last_updated_at = max(last_updated_at, rec['updated_at'])
+            # windowed listings keep the bookmark themselves
+            bookmark = None
+            if page and not window_size:
+                bookmark = helper.next_second(page[-1]['updated_at'])
+            yield stream, page, bookmark
+
+        # windows finished before a resume weren't listed in this run, so they may be missing
+        # from the index and the range can't count as covered
+        if not predefined_filter and not (listing and listing.resumed):
+            self.client.ticket_index.mark_covered(pass_start, last_updated_at)
+
+    def sync(self, start_date):
+        completed = False
+        try:
+            window_days = float(self.config.get("window_days", 0))
+            window_size = window_days and datetime.timedelta(days=window_days)
+
+            # the filter passes run at the same time and share the client's rate limit
+            passes = [self.list_filter(predefined_filter, start_date, window_size)
+                      for predefined_filter in TICKET_FILTERS]
+            for stream, page, bookmark in helper.interleave(passes):
+                yield from page
+                helper.update_state(self.state, stream, bookmark)
+                self.checkpointer.checkpoint(len(page))
+            # windowed listings save their final bookmarks once their last window is done
+            self.checkpointer.checkpoint()
+            completed = True
+        finally:
+            # release the side streams waiting for this run's tickets
+            for harvest in self.client.sideloads.values():
+                harvest.close(failed=not completed)
+
+
+class TicketSideload(Stream):
+    # Objects embedded in the tickets synced by the tickets stream in the same
+    # run, each in its newest version; emitted once the tickets stream is done.
+    custom_fields = False
+    key_properties = ["id"]
+    replication_method = "FULL_TABLE"
+    replication_keys = []
+
+    def sync(self, start_date):
+        harvest = self.client.sideloads.get(self.sideload)
+        if harvest is None:
+            LOGGER.warning("Stream {} is only filled when the tickets stream is selected".format(self.stream_id))
+            return
+        yield from harvest.wait()
+
 
-                helper.update_state(self.state, stream, start_date)
-                singer.write_state(self.state)
+class TicketRequesters(TicketSideload):
+    stream_id = 'ticket_requesters'
+    stream_name = 'ticket_requesters'
+    sideload = 'requester'
+
+
+class TicketCompanies(TicketSideload):
+    stream_id = 'ticket_companies'
+    stream_name = 'ticket_companies'
+    sideload = 'company'
 
 
 class Conversations(Stream):
@@ -194,23 +364,68 @@ class Conversations(Stream):
     endpoint = 'tickets/{id}/conversations'
     custom_fields = False
     key_properties = ["id"]
-    replication_method = "FULL_TABLE"
-    replication_keys = []
-    ticket_ids = []
+    replication_method = "INCREMENTAL"
+    replication_keys = ["updated_at"]
 
-    def get_all_tickets(self):
+    def get_all_tickets(self, start_date):
+        # only tickets updated since the conversations bookmark can have new conversations
         tickets = Tickets(self.client, self.config, self.state)
-        return tickets.get_all_ticket_ids()
-
+        return tickets.get_updated_tickets(start_date)
+
+    def get_fingerprint(self):
+        # tickets are listed by updated_at, so positions hold across runs
+        return None
+
+    def position(self, ticket):
+        # where a ticket is in the order get_all_tickets lists them
+        ticket_id, updated_at = ticket
+        return [updated_at, ticket_id]
+
+    def fetch_conversations(self, ticket_id, updated_at):
+        # served from the run's response cache when another stream fetched the same version
+        cache = self.client.response_cache
+        key = [self.endpoint, ticket_id, updated_at]
+        if cache is not None and updated_at:
+            records = cache.get(key)
+            if records is not None:
+                return records
+        records = []
+        for page in self.client.get(self.endpoint.format(id=ticket_id), params={}):
+            for rec in page:
+                rec.pop("attachments", None)
+                rec.pop("body", None)
+                records.append(rec)
+        if cache is not None and updated_at:
+            cache.put(key, records)
+        return records
+
+    def get_ticket_conversations(self, ticket):
+        ticket_id, updated_at = ticket
+        if updated_at is None and self.client.response_cache is not None:
+            # report tickets come without updated_at; the index has it if the ticket was listed
+            updated_at = self.client.ticket_index.updated_at(ticket_id)
+        return ticket, self.project(self.fetch_conversations(ticket_id, updated_at))
 
     def sync(self, start_date):
-        for ticket_id in self.get_all_tickets():
-            pages = self.client.get(self.endpoint.format(id=ticket_id), params={})
-            for page in pages:
-                for rec in page:
-                    rec.pop("attachments", None)
-                    rec.pop("body", None)
-                    yield rec
+        fingerprint = self.get_fingerprint()
+        tickets = self.get_all_tickets(start_date)
+        resume = self.resume_position(fingerprint)
+        if resume is not None:
+            # skip the tickets an interrupted run already finished
+            tickets = itertools.dropwhile(lambda ticket: self.position(ticket) <= resume, tickets)
+
+        # fetch several tickets at once; results come back in ticket order
+        conversations = helper.ordered_map(self.get_ticket_conversations, tickets, self.client.max_workers)
+        for count, (ticket, records) in enumerate(conversations, 1):
+            yield from records
+            # every ticket up to this one is done
+            updated_at = ticket[1]
+            if updated_at:
+                helper.update_state(self.state, self.stream_id, updated_at)
+            self.save_progress(fingerprint, self.position(ticket))
+            self.checkpointer.checkpoint(len(records), page_end=count % PER_PAGE == 0)
+        self.clear_progress()
+        self.checkpointer.checkpoint()
 
 
 RATINGS = {
@@ -226,6 +441,8 @@ RATINGS = {
     3: "Unhappy"
 }
 
+DEFAULT_SURVEY_CACHE_TTL = 86400
+
 
 class SatisfactionRatings(Stream):
     stream_id = 'satisfaction_ratings'
@@ -233,33 +450,54 @@ class SatisfactionRatings(Stream):
     endpoint = 'surveys/satisfaction_ratings'
     custom_fields = False
     key_properties = ["id"]
-    replication_method = "FULL_TABLE"
-    replication_keys = []
+    replication_method = "INCREMENTAL"
+    replication_keys = ["created_at"]
+
+    def get_questions(self, refresh=False):
+        # {question id: label} over all questions of all surveys. With
+        # survey_cache_path it is kept on disk per domain for survey_cache_ttl seconds.
+        path = self.config.get("survey_cache_path")
+        domain = self.config.get("domain", "")
+        if path and not refresh:
+            cached = helper.read_domain_cache(path, domain)
+            ttl = float(self.config.get("survey_cache_ttl", DEFAULT_SURVEY_CACHE_TTL))
+            if isinstance(cached, dict) and time.time() - cached.get("fetched_at", 0) < ttl:
+                return cached["questions"]
+
+        questions = {}
+        for survey_page in self.client.get("surveys", params={}):
+            for survey in survey_page:
+                for question in survey.get("questions") or []:
+                    questions[question["id"]] = question.get("label")
+        if path:
+            helper.write_domain_cache(path, domain, {"fetched_at": time.time(), "questions": questions})
+        return questions
 
     def sync(self, start_date):
-        params = {}
-        questions = []
-        # Get survey questions (id, label)
-        for question_page in self.client.get("surveys", params={}):
-            for question in question_page:
-                if question.get("questions", False):
-                    questions.append(question.get("questions", False)[0])
+        params = {'created_since': start_date}
+        last_created_at = None
+        questions = self.get_questions()
+        refreshed = False
 
         records = self.client.get(self.endpoint, params=params)
         for page in records:
             for rec in page:
-                if rec.get('ratings', False):
-                    response = []
-                    for k, v in rec['ratings'].items():
-                        label = [qw["label"] for qw in questions if qw["id"] == k]
-                        response.append({"question_id": k,
-                                         "question_label": label and label[0] or "",
-                                         "rating_id": v,
-                                         "rating_label": RATINGS.get(v, False)})
-
-                    rec.pop('ratings')  # remove dict
-                    rec['ratings'] = response  # insert array of objects
+                ratings = rec.get('ratings', False)
+                if ratings:
+                    if not refreshed and not questions.keys() >= ratings.keys():
+                        # a survey was added or changed since the questions were cached
+                        questions = self.get_questions(refresh=True)
+                        refreshed = True
+                    # replace the dict with an array of objects
+                    rec['ratings'] = [{"question_id": k,
+                                       "question_label": questions.get(k) or "",
+                                       "rating_id": v,
+                                       "rating_label": RATINGS.get(v, False)}
+                                      for k, v in ratings.items()]
+                if rec.get('created_at'):
+                    last_created_at = max(last_created_at or rec['created_at'], rec['created_at'])
                 yield rec
+        self.save_bookmark(last_created_at)
 
 
 class TimeEntries(Stream):
@@ -270,12 +508,14 @@ class TimeEntries(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
+    # entries can be logged with an earlier executed_at or edited later, so
+    # there is no bookmark that catches every change
+    change_detection = True
 
     def sync(self, start_date):
         for page in self.client.get(self.endpoint, params={}):
             for rec in page:
                 yield rec
-            singer.write_state(self.state)
 
 class ExportReport(Stream):
     stream_id = 'export_report'
@@ -285,44 +525,69 @@ class ExportReport(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
-    report_tickets = []
 
     def get_records(self):
         params = {"uuid":self.config.get("report_id")}
-        url = "https://timeinternet.freshdesk.com/reports/schedule/download_file.json"
+        url = self.client.get_domain_url(self.endpoint)
         resp = self.client._make_request_internal(full_url=url,api_key=self.config.get("api_key"),params=params)
         if resp.status_code == 200:
             data = resp.json()
             if "export" in data:
                 if "url" in data['export']:
-                    url = data['export']['url']
-                    csv_file = requests.get(url)
-                    # Read the CSV content from the response
-                    csv_content = csv_file.text
-                    # Use StringIO to create a file-like object for csv.reader
-                    csv_file = StringIO(csv_content)
-                    csv_reader = csv.DictReader(csv_file)
-                    return csv_reader
+                    yield from self.read_csv(data['export']['url'])
+
+    def count_bytes(self, chunks):
+        for chunk in chunks:
+            self.client.metrics.received(DOWNLOAD_ENDPOINT, len(chunk))
+            yield chunk
+
+    def read_csv(self, url):
+        # Stream the export and parse rows as they arrive instead of holding the file in memory
+        started = time.monotonic()
+        with self.client.session.get(url, stream=True) as resp:
+            self.client.metrics.request(DOWNLOAD_ENDPOINT, time.monotonic() - started, resp.status_code, 0)
+            resp.raise_for_status()
+            chunks = self.count_bytes(resp.iter_content(chunk_size=CSV_CHUNK_SIZE))
+            csv_reader = csv.DictReader(helper.iter_lines(chunks, resp.encoding or "utf-8-sig"))
+            if not csv_reader.fieldnames:
+                return
+            # Convert keys to lowercase and replace spaces with underscores, once per file
+            csv_reader.fieldnames = [key.lower().replace(' ', '_') for key in csv_reader.fieldnames]
+            for row in csv_reader:
+                yield self.project([row], keep=['ticket_id'])[0]
 
     def sync(self, start_date):
         if self.config.get("report_id",None):
-            csv_reader = self.get_records()
-            # Iterate over each row in the CSV
-            for row in csv_reader:
-                # Convert keys to lowercase and replace spaces with underscores
-                processed_row = {key.lower().replace(' ', '_'): value for key, value in row.items()}
-                # Process each row as needed
-                self.report_tickets.append(processed_row['ticket_id'])
-                yield processed_row
+            index = self.client.ticket_index
+            ticket_ids = []
+            with index.report_lock:
+                index.begin_report()
+                for processed_row in self.get_records():
+                    # Process each row as needed
+                    ticket_ids.append(processed_row['ticket_id'])
+                    if len(ticket_ids) >= PER_PAGE:
+                        index.add_report_tickets(ticket_ids)
+                        ticket_ids = []
+                    yield processed_row
+                index.add_report_tickets(ticket_ids)
+                # publish the ids only once complete, report streams may be waiting on them
+                index.commit_report()
         else:
             return []
+
     def get_report_tickets(self):
-        if not self.report_tickets:
-            res = self.sync(None)
-            #process the generator
-            res = list(res)
-            return self.report_tickets
-        return self.report_tickets    
+        index = self.client.ticket_index
+        with index.report_lock:
+            if not index.report_loaded and self.config.get("report_id", None):
+                index.begin_report()
+                index.add_report_tickets(row['ticket_id'] for row in self.get_records())
+                index.commit_report()
+        return index.report_ticket_ids()
+
+    def get_report_fingerprint(self):
+        self.get_report_tickets()
+        return self.client.ticket_index.report_fingerprint()
+
 
 class ReportTickets(Stream):
     stream_id = 'report_tickets'
@@ -332,26 +597,56 @@ class ReportTickets(Stream):
     key_properties = ["id"]
     replication_method = "FULL_TABLE"
     replication_keys = []
-    ticket_ids = []
 
     def get_all_tickets(self):
         tickets = ExportReport(self.client, self.config, self.state)
         return tickets.get_report_tickets()
-    
+
+    def get_ticket(self, ticket_id):
+        cached = self.client.ticket_cache.get(ticket_id)
+        if cached is not None:
+            return self.project([copy.deepcopy(cached)])[0]
+        url = self.client.get_base_url(self.endpoint.format(id=ticket_id))
+        resp = self.client._make_request_internal(full_url=url,api_key=self.config.get("api_key"),params=None)
+        resp.raise_for_status()
+        return self.project([resp.json()])[0]
+
     def sync(self, start_date):
-        for ticket_id in self.get_all_tickets():
-            url = self.client.get_base_url(self.endpoint.format(id=ticket_id))
-            resp = self.client._make_request_internal(full_url=url,api_key=self.config.get("api_key"),params=None)
-            resp.raise_for_status()
-            yield resp.json()
+        fingerprint = ExportReport(self.client, self.config, self.state).get_report_fingerprint()
+        ticket_ids = self.get_all_tickets()
+        resume = self.resume_position(fingerprint)
+        if resume is not None:
+            # report ticket ids come in ascending order; skip the ones an interrupted run finished
+            ticket_ids = itertools.dropwhile(lambda ticket_id: [ticket_id] <= resume, ticket_ids)
+
+        # tickets already synced in this run come from the cache, the rest are fetched concurrently
+        fetched = helper.ordered_map(lambda ticket_id: (ticket_id, self.get_ticket(ticket_id)),
+                                     ticket_ids, self.client.max_workers)
+        for count, (ticket_id, rec) in enumerate(fetched, 1):
+            yield rec
+            self.save_progress(fingerprint, [ticket_id])
+            self.checkpointer.checkpoint(1, page_end=count % PER_PAGE == 0)
+        self.clear_progress()
+        self.checkpointer.checkpoint()
+
+
 class ReportConversations(Conversations):
     stream_id = 'report_conversations'
     stream_name = 'report_conversations'
     endpoint = 'tickets/{id}/conversations'
+    replication_method = "FULL_TABLE"
+    replication_keys = []
 
-    def get_all_tickets(self):
+    def get_all_tickets(self, start_date):
         tickets = ExportReport(self.client, self.config, self.state)
-        return tickets.get_report_tickets()
+        for ticket_id in tickets.get_report_tickets():
+            yield ticket_id, None
+
+    def get_fingerprint(self):
+        return ExportReport(self.client, self.config, self.state).get_report_fingerprint()
+
+    def position(self, ticket):
+        return [ticket[0]]
         
 STREAM_OBJECTS = {
     'agents': Agents,
@@ -360,6 +655,8 @@ STREAM_OBJECTS = {
     'groups': Groups,
     'roles': Roles,
     'tickets': Tickets,
+    'ticket_requesters': TicketRequesters,
+    'ticket_companies': TicketCompanies,
     'conversations': Conversations,
     'satisfaction_ratings': SatisfactionRatings,
     'time_entries': TimeEntries,
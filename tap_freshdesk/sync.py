@@ -1,65 +1,169 @@
-import backoff
+import concurrent.futures
+import datetime
 import sys
 import time
 import requests
 # This is where the sync function is run
 import singer
 from requests.exceptions import HTTPError
-from singer import Transformer, metadata
+from singer import metadata
 
-from tap_freshdesk import helper
+from tap_freshdesk import helper, output
+from .cache import Harvest, ResponseCache, DEFAULT_RESPONSE_CACHE_BYTES
 from .streams import STREAM_OBJECTS
+from .transform import RecordTransformer
 
 logger = singer.get_logger()
 session = requests.Session()
 
 BASE_URL = "https://{}.freshdesk.com"
+# set on the records change detection reports as deleted
+DELETED_AT = "_sdc_deleted_at"
 CONFIG = {}
 STATE = {}
 
 
-def get_start(entity):
-    if entity not in STATE:
-        STATE[entity] = CONFIG.get('start_date', False)
-    return STATE[entity]
+def get_start(config, state, entity):
+    return state.get(entity, config.get('start_date', False))
 
 
-def sync(client, config: dict, state: dict, catalog: singer.Catalog):
+def sync_stream(client, config, state, stream, writer):
+    stream_id = stream.tap_stream_id
+    stream_schema = stream.schema
+    stream_class = STREAM_OBJECTS.get(stream_id)
+    if stream_class is None:
+        raise Exception("Attempted to sync unknown stream {}".format(stream_id))
+
+    stream_object = stream_class(client, config, state, writer)
+    schema = stream_schema.to_dict()
+
+    changes = None
+    emit_deletions = False
+    if stream_object.change_detection and client.record_hashes:
+        changes = client.record_hashes.stream(stream_id, stream_object.key_properties)
+        emit_deletions = bool(config.get("emit_deletions"))
+    if emit_deletions:
+        schema["properties"][DELETED_AT] = {"type": ["null", "string"], "format": "date-time"}
+
+    writer.write_schema(
+        stream_id,
+        schema,
+        stream_object.key_properties,
+        stream_object.replication_keys,
+    )
+
+    start = get_start(config, state, stream_id)
+    logger.info("Syncing stream {} from {}".format(stream_id, start))
+
+    clock = time.perf_counter
+    records, transform_seconds, write_seconds = 0, 0.0, 0.0
+    started = clock()
+    with RecordTransformer(schema, stream.metadata) as transformer:
+        # lets the stream shape its requests and drop deselected fields early
+        stream_object.deselected = frozenset(transformer.filtered)
+        for rec in stream_object.sync(start):
+            transform_started = clock()
+            rec = transformer.transform(rec)
+            write_started = clock()
+            transform_seconds += write_started - transform_started
+            if changes is not None and not changes.changed(rec):
+                continue
+            writer.write_record(stream_id, rec)
+            write_seconds += clock() - write_started
+            records += 1
+    if changes is not None:
+        if emit_deletions:
+            deleted_at = helper.strftime(datetime.datetime.utcnow())
+            for deleted in changes.deleted():
+                deleted[DELETED_AT] = deleted_at
+                writer.write_record(stream_id, deleted)
+                records += 1
+        logger.info("Skipped {} unchanged records of stream {}".format(changes.unchanged, stream_id))
+        # the records have to reach the output before their hashes count as emitted
+        writer.flush()
+        changes.commit()
+    # write whatever the checkpoint policy held back
+    stream_object.checkpointer.finish()
+    client.metrics.stream(stream_id, records, clock() - started, transform_seconds, write_seconds)
+    logger.info("Finished syncing stream {}".format(stream_id))
+
+
+def get_sideload(stream):
+    return getattr(STREAM_OBJECTS.get(stream.tap_stream_id), "sideload", None)
+
+
+def sync(client, config: dict, state: dict, catalog: singer.Catalog, writer=None):
     logger.info("Starting FreshDesk sync")
-    for stream in catalog.streams:
-        stream_id = stream.tap_stream_id
-        stream_schema = stream.schema
-        stream_object = STREAM_OBJECTS.get(stream_id)(client, config, state)
-        schema = stream_schema.to_dict()
+    writer = writer or output.Writer.from_config(config)
+    try:
+        sync_streams(client, config, state, catalog, writer)
+    finally:
+        writer.close()
+        client.metrics.report(config.get("metrics_summary_path"))
 
+
+def sync_streams(client, config, state, catalog, writer):
+    streams = []
+    for stream in catalog.streams:
         if not metadata.to_map(stream.metadata).get((), {}).get("selected"):
-            logger.info(f"Skipping stream {stream_id} as it is not selected.")
+            logger.info(f"Skipping stream {stream.tap_stream_id} as it is not selected.")
             continue
+        streams.append(stream)
+
+    # higher priority streams are started first, e.g. to get the slowest going early
+    priorities = config.get("stream_priorities") or {}
+    streams.sort(key=lambda stream: -int(priorities.get(stream.tap_stream_id, 0)))
+
+    # side streams are filled while tickets are synced and wait for it, so they go last
+    selected = {stream.tap_stream_id for stream in streams}
+    for stream in streams:
+        sideload = get_sideload(stream)
+        if sideload and "tickets" in selected:
+            client.sideloads[sideload] = Harvest()
+    streams.sort(key=lambda stream: get_sideload(stream) is not None)
+
+    # streams that may only start once another one has finished, by the stream they wait for
+    waiting = {}
+    if {"conversations", "report_conversations"} <= selected:
+        # report tickets are mostly ones the conversations stream visits in the same run,
+        # so report conversations run after it and are served from its responses
+        client.response_cache = ResponseCache(
+            int(config.get("response_cache_bytes", DEFAULT_RESPONSE_CACHE_BYTES)),
+            config.get("response_cache_path"))
+        streams.sort(key=lambda stream: stream.tap_stream_id == "report_conversations")
+        waiting["conversations"] = [stream for stream in streams
+                                    if stream.tap_stream_id == "report_conversations"]
+    if client.ticket_cache and {"tickets", "report_tickets"} <= selected:
+        # report tickets are served from the tickets this run listed, so they wait for the listing
+        streams.sort(key=lambda stream: stream.tap_stream_id == "report_tickets")
+        waiting["tickets"] = [stream for stream in streams if stream.tap_stream_id == "report_tickets"]
+
+    max_concurrency = int(config.get("max_stream_concurrency", 1))
+    if max_concurrency <= 1:
+        for stream in streams:
+            sync_stream(client, config, state, stream, writer)
+        return
 
-        if stream_object is None:
-            raise Exception("Attempted to sync unknown stream {}".format(stream_id))
-
-        singer.write_schema(
-            stream_id,
-            schema,
-            stream_object.key_properties,
-            stream_object.replication_keys,
-        )
-
-        start = get_start(stream_id)
-        logger.info("Syncing stream {} from {}".format(stream_id, start))
-
-        with Transformer() as transformer:
-            for rec in stream_object.sync(start):
-                # update custom fields from data retrieved
-                custom_fields = rec.get('custom_fields', False)
-                if custom_fields:
-                    rec.update(custom_fields)
-                    rec.pop('custom_fields')
-
-                singer.write_record(
-                    stream_id,
-                    transformer.transform(rec,
-                                          schema,
-                                          metadata.to_map(stream.metadata))
-                )
+    held_back = {id(stream) for streams_waiting in waiting.values() for stream in streams_waiting}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(sync_stream, client, config, state, stream, writer): stream
+                   for stream in streams if id(stream) not in held_back}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        for other in pending:
+                            other.cancel()
+                        future.result()
+                    for stream in waiting.pop(futures[future].tap_stream_id, []):
+                        follower = executor.submit(sync_stream, client, config, state, stream, writer)
+                        futures[follower] = stream
+                        pending.add(follower)
+        except BaseException:
+            # side streams still waiting on tickets would otherwise keep the executor from shutting down
+            for harvest in client.sideloads.values():
+                harvest.close(failed=True)
+            raise
@@ -0,0 +1,203 @@
+# Record transformation for the sync loop.
+import datetime
+import re
+
+from singer import Transformer, metadata
+from singer.transform import SchemaMismatch
+
+# returned by a compiled converter when a value needs the generic transformer
+MISS = object()
+
+DATETIME_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z\Z")
+
+
+def _miss(value):
+    return MISS
+
+
+def _unchanged(value):
+    return value
+
+
+def _datetime(value):
+    # "2020-01-01T10:00:00Z" is what the API returns; singer writes it with microseconds
+    if type(value) is str and DATETIME_RE.match(value):
+        try:
+            datetime.datetime.fromisoformat(value[:-1])
+        except ValueError:
+            return MISS
+        return value[:-1] + ".000000Z"
+    return MISS
+
+
+def _string(value):
+    return value if type(value) is str else MISS
+
+
+def _integer(value):
+    return value if type(value) is int else MISS
+
+
+def _number(value):
+    if type(value) is float:
+        return value
+    if type(value) is int:
+        return float(value)
+    return MISS
+
+
+def _boolean(value):
+    return value if type(value) is bool else MISS
+
+
+def _object(properties):
+    if not properties:
+        return lambda value: value if isinstance(value, dict) else MISS
+
+    converters = {key: compile_schema(sub_schema) for key, sub_schema in properties.items()}
+
+    def convert(value):
+        if type(value) is not dict:
+            return MISS
+        result = {}
+        for key, sub_value in value.items():
+            converter = converters.get(key)
+            if converter is None:
+                return MISS
+            sub_value = converter(sub_value)
+            if sub_value is MISS:
+                return MISS
+            result[key] = sub_value
+        return result
+
+    return convert
+
+
+def _array(items):
+    item_converter = compile_schema(items)
+
+    def convert(value):
+        if type(value) is not list:
+            return MISS
+        result = []
+        for item in value:
+            item = item_converter(item)
+            if item is MISS:
+                return MISS
+            result.append(item)
+        return result
+
+    return convert
+
+
+def _nullable(converter):
+    def convert(value):
+        if value is None:
+            return None
+        return converter(value)
+
+    return convert
+
+
+def compile_schema(schema):
+    # Build a converter that returns exactly what singer's Transformer would for
+    # the common, unambiguous cases and MISS for everything else.
+    if "anyOf" in schema or "patternProperties" in schema:
+        return _miss
+    if "type" not in schema:
+        return _unchanged
+
+    types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+    non_null = [typ for typ in types if typ != "null"]
+    if len(non_null) != 1:
+        return _miss
+
+    typ = non_null[0]
+    if schema.get("format") == "date-time":
+        converter = _datetime
+    elif typ == "string":
+        converter = _string
+    elif typ == "integer":
+        converter = _integer
+    elif typ == "number":
+        converter = _number
+    elif typ == "boolean":
+        # singer turns None into False for booleans, leave that to it
+        return _boolean
+    elif typ == "object":
+        converter = _object(schema.get("properties", {}))
+    elif typ == "array":
+        converter = _array(schema["items"])
+    else:
+        return _miss
+
+    return _nullable(converter) if "null" in types else converter
+
+
+class RecordTransformer:
+    """Transforms the records of one stream, planned once from its schema and metadata.
+
+    Output is the same as merging ``custom_fields`` into the record and running
+    singer's ``Transformer.transform`` with the stream's metadata, but the
+    metadata map, the deselected fields and a converter per field are worked
+    out up front. Values the converters can't handle fall back to singer.
+    """
+
+    def __init__(self, schema, stream_metadata):
+        self.transformer = Transformer()
+        self.schema = schema
+        self.metadata = metadata.to_map(stream_metadata)
+        self.properties = schema.get("properties", {})
+        self.filtered = set()
+        for breadcrumb, field_metadata in self.metadata.items():
+            if len(breadcrumb) != 2 or breadcrumb[0] != "properties":
+                continue
+            if field_metadata.get("inclusion") == "automatic":
+                continue
+            if field_metadata.get("selected") is False or field_metadata.get("inclusion") == "unsupported":
+                self.filtered.add(breadcrumb[1])
+        self.converters = {key: compile_schema(sub_schema) for key, sub_schema in self.properties.items()}
+        self.compiled = (schema.get("type") == "object" and self.properties
+                         and "patternProperties" not in schema and "anyOf" not in schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.transformer.log_warning()
+
+    def transform(self, rec):
+        # custom fields are flattened into the record
+        custom_fields = rec.get('custom_fields', False)
+        if not self.compiled or not isinstance(rec, dict):
+            if custom_fields:
+                rec.update(custom_fields)
+                rec.pop('custom_fields')
+            return self.transformer.transform(rec, self.schema, self.metadata)
+
+        if custom_fields:
+            items = [(key, custom_fields.get(key, value)) for key, value in rec.items()
+                     if key != 'custom_fields']
+            items.extend((key, value) for key, value in custom_fields.items() if key not in rec)
+        else:
+            items = rec.items()
+
+        result = {}
+        success = True
+        for key, value in items:
+            if key in self.filtered:
+                self.transformer.filtered.add(key)
+                continue
+            converter = self.converters.get(key)
+            if converter is None:
+                self.transformer.removed.add(key)
+                continue
+            converted = converter(value)
+            if converted is MISS:
+                ok, converted = self.transformer.transform_recur(value, self.properties[key], [key])
+                success = success and ok
+            result[key] = converted
+
+        if not success:
+            raise SchemaMismatch(self.transformer.errors)
+        return result
@@ -0,0 +1,190 @@
+# Time-window partitioned listing for endpoints ordered by updated_at.
+import concurrent.futures
+import datetime
+import queue
+import threading
+
+import singer
+
+from tap_freshdesk import helper
+from tap_freshdesk.client import PAGE_LIMIT, PER_PAGE
+
+LOGGER = singer.get_logger()
+
+# state[WINDOWS_KEY][state_key] holds the [cursor, end] pairs of unfinished windows
+WINDOWS_KEY = "windows"
+
+
+class Window:
+    def __init__(self, start, end, seen=()):
+        # updated_at the window is listed from next; it moves with every page emitted
+        self.cursor = start
+        # exclusive upper bound, None for the open-ended last window
+        self.end = end
+        # ids already emitted at `cursor`, skipped when listing again from it
+        self.seen = set(seen)
+        self.done = False
+
+
+def split_range(start, now, size):
+    # [start, now) in windows of `size`; the last one is left open-ended
+    windows = []
+    lower, upper = helper.strptime(start), helper.strptime(now)
+    while lower + size < upper:
+        windows.append(Window(helper.strftime(lower), helper.strftime(lower + size)))
+        lower += size
+    windows.append(Window(helper.strftime(lower), None))
+    return windows
+
+
+def split_window(window):
+    # two halves of what is left of a window that hit the page limit
+    if window.end is None:
+        return [window]
+    lower, upper = helper.strptime(window.cursor), helper.strptime(window.end)
+    if upper - lower <= datetime.timedelta(seconds=1):
+        return [window]
+    middle = helper.strftime(lower + (upper - lower) // 2)
+    return [Window(window.cursor, middle, window.seen), Window(middle, window.end)]
+
+
+class WindowedListing:
+    """Lists an endpoint ordered by ``updated_at`` as concurrent time windows.
+
+    The range from the bookmark to now is cut into windows of ``window_size``
+    that are listed at the same time. A window that runs into the API's page
+    limit is split again instead of paging on from the last record, and records
+    sharing the boundary second are de-duplicated by id rather than skipped.
+
+    After every page handed out, the bookmark under ``state_key`` is set to the
+    oldest point any unfinished window still has to list from, and the
+    unfinished windows are kept in the state so a new run resumes them.
+    """
+
+    def __init__(self, client, endpoint, params, since_param, state, state_key, window_size):
+        self.client = client
+        self.endpoint = endpoint
+        self.params = params
+        self.since_param = since_param
+        self.state = state
+        self.state_key = state_key
+        self.window_size = window_size
+        self.windows = []
+        self.max_updated_at = None
+        # whether only the unfinished windows of an earlier run are listed
+        self.resumed = False
+
+    def load_windows(self, start_date):
+        saved = self.state.get(WINDOWS_KEY, {}).get(self.state_key)
+        if saved:
+            LOGGER.info("Resuming %s unfinished windows for %s", len(saved), self.state_key)
+            self.resumed = True
+            return [Window(cursor, end) for cursor, end in saved]
+        now = helper.strftime(datetime.datetime.utcnow())
+        return split_range(start_date, now, self.window_size)
+
+    def fetch(self, window, put):
+        # runs on a worker thread and returns the windows that still have to be listed
+        params = dict(self.params)
+        params[self.since_param] = window.cursor
+        boundary, seen = window.cursor, set(window.seen)
+        emitted = False
+        pages = 0
+        page = []
+        for page in self.client.get(self.endpoint, params=params, stop_at_page_limit=True):
+            pages += 1
+            records = []
+            reached_end = False
+            for rec in page:
+                updated_at = rec['updated_at']
+                if window.end is not None and updated_at >= window.end:
+                    reached_end = True
+                    break
+                if updated_at == boundary and rec['id'] in seen:
+                    continue
+                if updated_at != boundary:
+                    boundary, seen = updated_at, set()
+                seen.add(rec['id'])
+                records.append(rec)
+            emitted = emitted or bool(records)
+            if not put(("page", window, records, boundary, set(seen))):
+                return []
+            if reached_end:
+                return []
+
+        if pages < PAGE_LIMIT or len(page) < PER_PAGE:
+            return []
+
+        rest = Window(boundary, window.end, seen)
+        if not emitted:
+            # a whole listing of the same second; nothing left to narrow down
+            LOGGER.warning("More than %s records of %s updated at %s, moving on to the next second",
+                           PAGE_LIMIT * PER_PAGE, self.endpoint, boundary)
+            rest = Window(helper.strftime(helper.strptime(boundary) + datetime.timedelta(seconds=1)),
+                          window.end)
+        return split_window(rest)
+
+    def save_state(self):
+        with helper.STATE_LOCK:
+            unfinished = [window for window in self.windows if not window.done]
+            saved = self.state.setdefault(WINDOWS_KEY, {})
+            if unfinished:
+                saved[self.state_key] = [[window.cursor, window.end] for window in unfinished]
+                helper.update_state(self.state, self.state_key, min(window.cursor for window in unfinished))
+            else:
+                saved.pop(self.state_key, None)
+                if not saved:
+                    self.state.pop(WINDOWS_KEY)
+                helper.update_state(self.state, self.state_key, self.max_updated_at)
+
+    def pages(self, start_date, workers):
+        # yields pages of records; the state is updated once the caller moves past a page
+        self.windows = self.load_windows(start_date)
+        results = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+
+        def put(message):
+            while not stop.is_set():
+                try:
+                    results.put(message, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def run(window):
+            try:
+                put(("done", window, self.fetch(window, put)))
+            except Exception as e:
+                put(("error", window, e))
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(run, window) for window in self.windows]
+        active = len(self.windows)
+        try:
+            while active:
+                message = results.get()
+                kind, window = message[0], message[1]
+                if kind == "error":
+                    raise message[2]
+                if kind == "page":
+                    records, window.cursor, window.seen = message[2:]
+                    if records:
+                        yield records
+                        if self.max_updated_at is None or window.cursor > self.max_updated_at:
+                            self.max_updated_at = window.cursor
+                else:
+                    active -= 1
+                    window.done = True
+                    follow_up = message[2]
+                    self.windows.extend(follow_up)
+                    for next_window in follow_up:
+                        next_window.done = False
+                        futures.append(executor.submit(run, next_window))
+                        active += 1
+                self.save_state()
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)